@@ -12,78 +12,388 @@ Usage:
 """
 
 import os
+import re
+import array
 import sys
 import time
 import json
+import fcntl
+import hashlib
+import queue
+import atexit
+import select
+import socket
+import struct
+import tempfile
+import threading
 import subprocess
 import logging
+import logging.handlers
 import dbus
 import dbus.mainloop.glib
 from pathlib import Path
 from typing import Optional, Dict, Any
 from gi.repository import GLib
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/android_wifi_direct_sharer.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: callers only enqueue records, a background listener
+# thread does the formatting and the file/console writes
+_log_queue = queue.Queue(-1)
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.handlers.RotatingFileHandler('/var/log/android_wifi_direct_sharer.log',
+                                         maxBytes=1 << 20, backupCount=3),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+# wpa_supplicant control interface directory (matches ctrl_interface in our configs)
+WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+
+# Output sink for commands whose output is never inspected
+_DN = subprocess.DEVNULL
+
+# Fields reported in P2P-DEVICE-FOUND events. The first address may be the
+# interface address, so p2p_dev_addr (which P2P_CONNECT and P2P_SERV_DISC_REQ
+# expect) overrides it as the device address when present.
+_EVENT_ADDR_RE = re.compile(r'P2P-DEVICE-FOUND ([0-9a-fA-F:]{17})')
+_EVENT_FIELD_RE = re.compile(r"\b(p2p_dev_addr|name|dev_capab)=('[^']*'|\S+)")
+_EVENT_FIELDS = {'p2p_dev_addr': 'address', 'name': 'name', 'dev_capab': 'capabilities'}
+
+# Lines of interest in P2P_PEER output: the peer address, then key=value fields
+_PEER_RE = re.compile(
+    r'^[ \t]*(?:([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})|(device_name|interface_addr|dev_capab)=(.*?))[ \t\r]*$',
+    re.M)
+_PEER_FIELDS = {'device_name': 'name', 'interface_addr': 'interface_address', 'dev_capab': 'capabilities'}
+
+# Any hint of network information in wpa_supplicant output from an Android peer
+_ANDROID_NET_RE = re.compile(r'network|ssid|wifi|hotspot|tethering', re.I)
+
+# Indicators of Android network information in wpa_supplicant query output
+_IND_RE = re.compile(r'network|ssid|wifi|android|p2p', re.I)
+
+# A raw 256-bit WPA PSK as wpa_supplicant accepts it unquoted
+_RAW_PSK_RE = re.compile(r'[0-9a-fA-F]{64}')
+
+# Fixed two-key layout of the saved credentials file (values are JSON-escaped)
+_CREDENTIALS_TEMPLATE = '{{"ssid": {ssid}, "password": {password}}}'
+
+def _atomic_write(path: str, content: str, mode: int = 0o644):
+    """Atomically replace path with content via a temp file in the same directory."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.write(fd, content.encode())
+        os.fchmod(fd, mode)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+def _wpa_psk(ssid: str, password: str) -> Optional[str]:
+    """Return password as the hex PSK wpa_supplicant takes unquoted, or None if it is invalid."""
+    if _RAW_PSK_RE.fullmatch(password):
+        return password.lower()
+    # A WPA passphrase is 8-63 printable ASCII characters; hashing it here
+    # means it never has to be quoted for wpa_supplicant
+    if 8 <= len(password) <= 63 and password.isascii() and password.isprintable():
+        return hashlib.pbkdf2_hmac('sha1', password.encode(), ssid.encode(), 4096, 32).hex()
+    return None
+
+def _wait_for(predicate, timeout: float, step: float = 0.01, cap: float = 0.2) -> bool:
+    """Poll predicate with exponential backoff until it holds or timeout expires."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if predicate():
+                return True
+        except OSError:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(step)
+        step = min(cap, step * 2)
+
+def _dump(label: str, blob, level: int = logging.INFO):
+    """Log a label and a multi-line blob, skipping all work if level is disabled."""
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s\n%s", label, blob() if callable(blob) else blob)
+
+def _interface_is_up(interface: str) -> bool:
+    """Return True if the IFF_UP flag is set for interface in sysfs."""
+    with open(f'/sys/class/net/{interface}/flags') as f:
+        return bool(int(f.read(), 16) & 0x1)
+
+# ioctl numbers and layout of struct ifreq (name + flags, padded to 40 bytes)
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+IFF_UP = 0x1
+_IFREQ_FLAGS = struct.Struct('16sH22x')
+
+def _set_interface_up(interface: str, up: bool):
+    """Set or clear IFF_UP on interface in-process, like 'ip link set up/down'."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        ifreq = fcntl.ioctl(s, SIOCGIFFLAGS, _IFREQ_FLAGS.pack(interface.encode(), 0))
+        flags = _IFREQ_FLAGS.unpack(ifreq)[1]
+        flags = flags | IFF_UP if up else flags & ~IFF_UP
+        fcntl.ioctl(s, SIOCSIFFLAGS, _IFREQ_FLAGS.pack(interface.encode(), flags))
+
+# Wireless extension ioctls used by iwconfig (struct iwreq is 32 bytes)
+SIOCGIWMODE = 0x8B07
+SIOCGIWESSID = 0x8B1B
+IW_MODE_MASTER = 3
+IW_ESSID_MAX_SIZE = 32
+_IWREQ_POINT = struct.Struct('16sPHH')
+
+def _wireless_state(interface: str) -> tuple:
+    """Return the (essid, mode) of interface in-process, like iwconfig."""
+    name = interface.encode()
+    essid = array.array('B', bytes(IW_ESSID_MAX_SIZE + 1))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        iwreq = _IWREQ_POINT.pack(name, essid.buffer_info()[0], len(essid), 0).ljust(32, b'\0')
+        length = _IWREQ_POINT.unpack_from(fcntl.ioctl(s, SIOCGIWESSID, iwreq))[2]
+        iwreq = fcntl.ioctl(s, SIOCGIWMODE, name.ljust(32, b'\0'))
+        mode = struct.unpack_from('I', iwreq, 16)[0]
+    return essid.tobytes()[:length].rstrip(b'\0').decode(errors='replace'), mode
+
+class WpaCtrl:
+    """Minimal client for the wpa_supplicant control interface socket."""
+
+    _instances = 0
+
+    def __init__(self, interface: str = "wlan0"):
+        WpaCtrl._instances += 1
+        self.local_path = f"/tmp/wpa_ctrl_{os.getpid()}-{WpaCtrl._instances}"
+        self.attached = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local_path):
+                os.unlink(self.local_path)
+            self.sock.bind(self.local_path)
+            self.sock.connect(os.path.join(WPA_CTRL_DIR, interface))
+        except OSError:
+            self.close()
+            raise
+
+    def request(self, command: str, timeout: float = 10.0) -> str:
+        """Send a command and return its reply, skipping unsolicited events."""
+        return self.request_many([command], timeout)[0]
+
+    def request_many(self, commands: list, timeout: float = 10.0) -> list:
+        """Send commands back to back, then read their replies in order."""
+        if not self.attached:
+            # Discard a late reply to an earlier request that timed out
+            self.sock.setblocking(False)
+            try:
+                while self.sock.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+        self.sock.settimeout(timeout)
+        for command in commands:
+            self.sock.send(command.encode())
+        replies = []
+        while len(replies) < len(commands):
+            reply = self.sock.recv(4096).decode(errors='replace')
+            if not (self.attached and reply.startswith('<')):
+                replies.append(reply)
+        return replies
+
+    def attach(self) -> bool:
+        """Register this socket for unsolicited event messages."""
+        self.attached = self.request('ATTACH').startswith('OK')
+        return self.attached
+
+    def wait_for_event(self, prefixes: tuple, timeout: float) -> Optional[str]:
+        """Block until an event starting with one of prefixes arrives."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return None
+
+            event = self.sock.recv(4096).decode(errors='replace')
+            # Strip the "<level>" priority prefix
+            if event.startswith('<'):
+                event = event.split('>', 1)[-1]
+            if event.startswith(prefixes):
+                return event
+
+    def close(self):
+        """Detach and remove the local socket."""
+        try:
+            if self.attached:
+                self.request('DETACH', timeout=1.0)
+        except OSError:
+            pass
+        self.attached = False
+        self.sock.close()
+        if os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+
+class ConnectedDevice:
+    """Bluetooth device currently connected to the sharer."""
+    __slots__ = ('path', 'name', 'address', 'connected_at')
+
+    def __init__(self, path: str, name: str, address: str, connected_at: float):
+        self.path = path
+        self.name = name
+        self.address = address
+        self.connected_at = connected_at
+
 class AndroidWiFiDirectSharer:
     def __init__(self):
         self.config_file = Path("/etc/wifi_credentials.json")
+        self.deps_stamp_file = Path("/var/lib/android_wifi_direct_sharer/.deps_ok")
         self.bluetooth_service_name = "PiWiFiSetup"
         self.mainloop = None
         self.bus = None
         self.adapter = None
-        self.connected_devices = set()
+        self.connected_devices = {}  # address -> ConnectedDevice
+        self.device_paths = {}  # D-Bus object path -> address
+        self.pending_devices = {}  # address -> name, awaiting extraction
+        self.pending_source_id = None
+        self.extraction_lock = threading.Lock()
         self.credentials_received = False
         self.wifi_direct_interface = "p2p0"
+        self.wpa = None
+        self.wpa_events = None
+        self.status_cache = {}  # key -> (monotonic timestamp, value)
         
     def check_dependencies(self) -> bool:
         """Check if required system packages are installed."""
         required_packages = ['bluez', 'bluez-tools', 'wpasupplicant', 'python3-dbus', 'python3-gi']
-        
-        missing_packages = []
-        for package in required_packages:
-            try:
-                subprocess.run(['dpkg', '-s', package], 
-                             capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                missing_packages.append(package)
-        
+
+        # Skip the check if the package database is unchanged since it last passed
+        try:
+            dpkg_mtime = str(os.stat('/var/lib/dpkg/status').st_mtime_ns)
+        except OSError:
+            dpkg_mtime = None
+
+        if (dpkg_mtime and self.deps_stamp_file.exists() and
+                self.deps_stamp_file.read_text() == dpkg_mtime):
+            logger.info("Dependencies unchanged since last successful check")
+            return True
+
+        # Query all packages with a single dpkg-query call. It exits non-zero
+        # when any package is unknown but still prints the others.
+        result = subprocess.run(['dpkg-query', '-W', '-f=${Package}\t${Status}\n',
+                               *required_packages],
+                              capture_output=True, text=True, check=False)
+
+        installed_packages = set()
+        for line in result.stdout.splitlines():
+            package, _, status = line.partition('\t')
+            if status == 'install ok installed':
+                installed_packages.add(package)
+
+        missing_packages = [package for package in required_packages
+                            if package not in installed_packages]
+
         if missing_packages:
             logger.error(f"Missing packages: {', '.join(missing_packages)}")
             logger.info("Install with: sudo apt update && sudo apt install " + 
                        " ".join(missing_packages))
             return False
         
-        # Check if WiFi Direct is supported
+        # Check if WiFi Direct is supported by the radio behind wlan0
         try:
-            result = subprocess.run(['wpa_cli', 'help'], 
+            with open('/sys/class/net/wlan0/phy80211/name') as f:
+                phy = f.read().strip()
+            result = subprocess.run(['iw', 'phy', phy, 'info'], 
                                   capture_output=True, text=True, check=False)
-            if 'p2p' not in result.stdout.lower():
-                logger.error("WiFi Direct (P2P) not supported by wpa_cli")
+            if 'P2P-client' not in result.stdout and 'P2P-GO' not in result.stdout:
+                logger.error(f"WiFi Direct (P2P) interface modes not supported by {phy}")
                 logger.error("Your Pi may not support WiFi Direct")
                 return False
             logger.info("WiFi Direct (P2P) support confirmed")
         except Exception as e:
             logger.warning(f"Could not verify WiFi Direct support: {e}")
         
+        # Remember the package database state this check passed against
+        if dpkg_mtime:
+            try:
+                self.deps_stamp_file.parent.mkdir(parents=True, exist_ok=True)
+                self.deps_stamp_file.write_text(dpkg_mtime)
+            except OSError as e:
+                logger.warning(f"Could not write dependency stamp file: {e}")
+        
         return True
     
+    def wpa_request(self, command: str, timeout: float = 1.0) -> str:
+        """Send a command to wpa_supplicant over the persistent control socket."""
+        return self.wpa_request_many([command], timeout)[0]
+    
+    def wpa_request_many(self, commands: list, timeout: float = 1.0) -> list:
+        """Pipeline several commands over the control socket in one round trip."""
+        if self.wpa is None:
+            self.wpa = WpaCtrl()
+        try:
+            return self.wpa.request_many(commands, timeout)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # wpa_supplicant was restarted behind our back - reconnect once
+            self.close_wpa()
+            self.wpa = WpaCtrl()
+            return self.wpa.request_many(commands, timeout)
+    
+    def wpa_ok(self, reply: str) -> bool:
+        """Return True if a wpa_supplicant reply does not report an error."""
+        return not reply.startswith(('FAIL', 'UNKNOWN COMMAND'))
+    
+    def get_wpa_status(self, max_age: float = 0.5) -> str:
+        """Return the STATUS reply, reusing one younger than max_age seconds."""
+        return self.cached_status('wpa STATUS', max_age, lambda: self.wpa_request('STATUS'))
+    
+    def close_wpa(self):
+        """Close the control socket, e.g. before wpa_supplicant is restarted."""
+        self.status_cache.pop('wpa STATUS', None)
+        if self.wpa:
+            self.wpa.close()
+            self.wpa = None
+    
+    def cached_status(self, key: str, ttl: float, query):
+        """Return query() for key, reusing a result younger than ttl seconds."""
+        now = time.monotonic()
+        cached = self.status_cache.get(key)
+        if cached and now - cached[0] < ttl:
+            return cached[1]
+        value = query()
+        self.status_cache[key] = (now, value)
+        return value
+    
+    def get_wireless_state(self) -> tuple:
+        """Return the (essid, mode) of wlan0, cached for 500 ms."""
+        return self.cached_status('wireless wlan0', 0.5, lambda: _wireless_state('wlan0'))
+    
+    def iter_p2p_peers(self, first_reply: Optional[str] = None):
+        """Yield the P2P_PEER details of each known peer as it is read."""
+        reply = first_reply if first_reply is not None else self.wpa_request('P2P_PEER FIRST')
+        while self.wpa_ok(reply) and reply.strip():
+            yield reply
+            address = reply.split('\n', 1)[0]
+            reply = self.wpa_request(f'P2P_PEER NEXT-{address}')
+    
+    def get_p2p_peers(self) -> str:
+        """Return the P2P_PEER details of every known peer."""
+        return ''.join(self.iter_p2p_peers())
+    
     def setup_bluetooth(self) -> bool:
         """Setup Bluetooth service for device detection."""
         try:
-            # Stop existing Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'stop', 'bluetooth'], 
-                         capture_output=True)
-            
             # Configure Bluetooth for Android compatibility
             bluetooth_config = f"""
 [General]
@@ -97,31 +407,46 @@ AutoEnable = true
 AutoEnable = true
 """
             
-            with open('/tmp/bluetooth.conf', 'w') as f:
-                f.write(bluetooth_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/bluetooth.conf', 
-                          '/etc/bluetooth/main.conf'], check=True)
-            
-            # Start Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'start', 'bluetooth'], 
-                         check=True)
-            subprocess.run(['sudo', 'systemctl', 'enable', 'bluetooth'], 
-                         check=True)
-            
-            # Make Pi discoverable and pairable
-            subprocess.run(['sudo', 'bluetoothctl', 'discoverable', 'on'], 
-                         check=True)
-            subprocess.run(['sudo', 'bluetoothctl', 'pairable', 'on'], 
-                         check=True)
-            
-            # Wait for Bluetooth to be ready
-            time.sleep(3)
-            
+            # Only rewrite the config and restart bluetoothd when it changed
+            try:
+                with open('/etc/bluetooth/main.conf') as f:
+                    config_changed = f.read() != bluetooth_config
+            except OSError:
+                config_changed = True
+            
+            if config_changed:
+                _atomic_write('/etc/bluetooth/main.conf', bluetooth_config)
+                restart_script = """
+systemctl stop bluetooth || true
+systemctl start bluetooth
+systemctl enable bluetooth
+"""
+            else:
+                logger.info("Bluetooth config unchanged, skipping service restart")
+                restart_script = """
+systemctl start bluetooth
+"""
+
+            # Make sure the Bluetooth service runs the current config and make
+            # the Pi discoverable and pairable in a single shell invocation
+            setup_script = restart_script + """
+# Wait for the adapter to power up instead of sleeping a fixed time
+for i in $(seq 50); do
+    bluetoothctl show | grep -q 'Powered: yes' && break
+    sleep 0.1
+done
+
+bluetoothctl <<EOF
+discoverable on
+pairable on
+EOF
+"""
+            subprocess.run(['sh', '-e', '-c', setup_script], check=True)
+
             logger.info("Bluetooth service configured successfully for Android")
             return True
             
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.error(f"Failed to setup Bluetooth: {e}")
             return False
     
@@ -135,134 +460,110 @@ AutoEnable = true
             
             logger.info("Cleaning up existing WiFi interfaces...")
             
-            # Kill any existing wpa_supplicant processes
-            subprocess.run(['sudo', 'killall', 'wpa_supplicant'], 
-                         capture_output=True, check=False)
-            subprocess.run(['sudo', 'killall', 'hostapd'], 
-                         capture_output=True, check=False)
-            
-            # Wait for processes to fully stop
-            time.sleep(3)
+            # Kill any existing wpa_supplicant/hostapd processes and stop the
+            # system services concurrently - they are independent of each other
+            self.close_wpa()
+            teardown_commands = [
+                ['killall', 'wpa_supplicant'],
+                ['killall', 'hostapd'],
+                ['systemctl', 'stop', 'wpa_supplicant'],
+                ['systemctl', 'stop', 'networking']
+            ]
+            teardown = [subprocess.Popen(command, stdout=_DN, stderr=_DN)
+                        for command in teardown_commands]
+            for process in teardown:
+                process.wait()
             
-            # Stop system services
-            subprocess.run(['sudo', 'systemctl', 'stop', 'wpa_supplicant'], 
-                         capture_output=True, check=False)
-            subprocess.run(['sudo', 'systemctl', 'stop', 'networking'], 
-                         capture_output=True, check=False)
+            # Wait for wpa_supplicant to exit and remove its control socket
+            wpa_ctrl_path = os.path.join(WPA_CTRL_DIR, 'wlan0')
+            if not _wait_for(lambda: not os.path.exists(wpa_ctrl_path), 5):
+                logger.warning("wpa_supplicant control socket still present after killall")
             
             # Bring down wlan0 interface
-            subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], 
-                         capture_output=True, check=False)
+            _set_interface_up('wlan0', False)
             
             # Wait for interface to be fully down
-            time.sleep(2)
+            _wait_for(lambda: not _interface_is_up('wlan0'), 3)
             
             # Bring up wlan0 interface
-            subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'up'], 
-                         capture_output=True, check=False)
+            _set_interface_up('wlan0', True)
             
             # Wait for interface to be ready
-            time.sleep(2)
+            if not _wait_for(lambda: _interface_is_up('wlan0'), 3):
+                logger.warning("wlan0 did not come up in time")
             
             logger.info("WiFi interface cleanup completed")
             
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Failed to clean up WiFi interfaces: {e}")
+        
+        # Minimal WiFi Direct configuration - compatible with all Pi versions
+        if self.start_wifi_direct("p2p_disabled=0\n", verify_status=True):
+            logger.info("Android-optimized WiFi Direct configured successfully")
+            return True
+        
+        # Fall back to a minimal Android configuration, reusing the cleanup above
+        logger.info("Trying fallback method...")
+        if self.start_wifi_direct("p2p_disabled=0\np2p_go_intent=0\n", verify_status=False):
+            logger.info("Android WiFi Direct fallback configured successfully")
+            return True
+        
+        logger.warning("Android WiFi Direct fallback also failed")
+        return False
+    
+    def start_wifi_direct(self, p2p_config: str, verify_status: bool) -> bool:
+        """Start wpa_supplicant with the given P2P settings and check P2P_FIND works."""
+        wpa_ctrl_path = os.path.join(WPA_CTRL_DIR, 'wlan0')
+        try:
+            # Stop a wpa_supplicant left running by a previous attempt
+            if os.path.exists(wpa_ctrl_path):
+                try:
+                    self.wpa_request('TERMINATE', timeout=2)
+                except OSError:
+                    pass
+                self.close_wpa()
+                if not _wait_for(lambda: not os.path.exists(wpa_ctrl_path), 5):
+                    logger.warning("wpa_supplicant control socket still present after TERMINATE")
+            
             # Create minimal, compatible wpa_supplicant configuration
             wpa_config = f"""
 ctrl_interface=/var/run/wpa_supplicant
 ctrl_interface_group=0
 update_config=1
 
-# Minimal WiFi Direct configuration - compatible with all Pi versions
-p2p_disabled=0
-"""
-            
-            with open('/tmp/wpa_supplicant.conf', 'w') as f:
-                f.write(wpa_config)
+{p2p_config}"""
             
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
+            _atomic_write('/etc/wpa_supplicant/wpa_supplicant.conf', wpa_config)
             
             # Start wpa_supplicant with WiFi Direct support
-            subprocess.run(['sudo', 'wpa_supplicant', '-B', '-i', 'wlan0', 
+            subprocess.run(['wpa_supplicant', '-B', '-i', 'wlan0', 
                           '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
                           '-D', 'nl80211'], check=True)
             
-            # Wait for WiFi Direct to be ready
-            time.sleep(5)
+            # Wait for wpa_supplicant to create its control socket
+            if not _wait_for(lambda: os.path.exists(wpa_ctrl_path), 10):
+                logger.warning("wpa_supplicant control socket did not appear in time")
             
             # Test if WiFi Direct is working
-            try:
-                result = subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], 
-                                      capture_output=True, text=True, check=False, timeout=10)
-                
-                if result.returncode == 0:
-                    # Additional verification - check if P2P interface was actually created
-                    time.sleep(2)
-                    p2p_check = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                             capture_output=True, text=True, check=False, timeout=5)
-                    
-                    if p2p_check.returncode == 0:
-                        logger.info("Android-optimized WiFi Direct configured successfully")
-                        return True
-                    else:
-                        logger.warning("WiFi Direct test passed but P2P interface not working")
-                        logger.warning(f"P2P check error: {p2p_check.stderr}")
-                        return self.setup_wifi_direct_fallback()
-                else:
-                    logger.warning(f"WiFi Direct test failed with return code {result.returncode}")
-                    logger.warning(f"Error output: {result.stderr}")
-                    return self.setup_wifi_direct_fallback()
-                    
-            except subprocess.TimeoutExpired:
-                logger.warning("WiFi Direct test timed out, using fallback method")
-                return self.setup_wifi_direct_fallback()
-            
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to setup WiFi Direct: {e}")
-            logger.info("Trying fallback method...")
-            return self.setup_wifi_direct_fallback()
-    
-    def setup_wifi_direct_fallback(self) -> bool:
-        """Fallback WiFi Direct setup for Android compatibility."""
-        try:
-            logger.info("Setting up WiFi Direct fallback for Android...")
-            
-            # Create minimal Android-compatible wpa_supplicant configuration
-            wpa_config = f"""
-ctrl_interface=/var/run/wpa_supplicant
-ctrl_interface_group=0
-update_config=1
-
-# Minimal Android WiFi Direct configuration
-p2p_disabled=0
-p2p_go_intent=0
-"""
-            
-            with open('/tmp/wpa_supplicant.conf', 'w') as f:
-                f.write(wpa_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
+            result = self.wpa_request('P2P_FIND', timeout=10)
+            if not self.wpa_ok(result):
+                logger.warning(f"WiFi Direct test failed: {result.strip()}")
+                return False
             
-            # Start wpa_supplicant with minimal config
-            subprocess.run(['sudo', 'wpa_supplicant', '-B', '-i', 'wlan0', 
-                          '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
-                          '-D', 'nl80211'], check=True)
+            if verify_status:
+                # Additional verification - check if P2P interface was actually created
+                _wait_for(lambda: 'p2p_device_address=' in self.wpa_request('STATUS', timeout=5), 2)
+                p2p_check = self.wpa_request('STATUS', timeout=5)
+                
+                if 'p2p_device_address=' not in p2p_check:
+                    logger.warning("WiFi Direct test passed but P2P interface not working")
+                    logger.warning("P2P check status: %s", p2p_check)
+                    return False
             
-            # Wait for wpa_supplicant to be ready
-            time.sleep(5)
+            return True
             
-            # Try basic P2P commands
-            try:
-                subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], check=True, timeout=5)
-                logger.info("Android WiFi Direct fallback configured successfully")
-                return True
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-                logger.warning("Android WiFi Direct fallback also failed")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Failed to setup Android WiFi Direct fallback: {e}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"Failed to start WiFi Direct: {e}")
             return False
     
     def setup_dbus(self) -> bool:
@@ -272,17 +573,25 @@ p2p_go_intent=0
             self.bus = dbus.SystemBus()
             self.mainloop = GLib.MainLoop()
             
-            # Get Bluetooth adapter
-            manager = dbus.Interface(
-                self.bus.get_object("org.bluez", "/"),
-                "org.freedesktop.DBus.ObjectManager"
-            )
-            
-            objects = manager.GetManagedObjects()
-            for path, interfaces in objects.items():
-                if "org.bluez.Adapter1" in interfaces:
-                    self.adapter = path
-                    break
+            # Get Bluetooth adapter, trying the default hci0 before enumerating everything
+            try:
+                adapter_props = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/org/bluez/hci0"),
+                    "org.freedesktop.DBus.Properties"
+                )
+                adapter_props.Get("org.bluez.Adapter1", "Address")
+                self.adapter = "/org/bluez/hci0"
+            except dbus.exceptions.DBusException:
+                manager = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/"),
+                    "org.freedesktop.DBus.ObjectManager"
+                )
+                
+                objects = manager.GetManagedObjects()
+                for path, interfaces in objects.items():
+                    if "org.bluez.Adapter1" in interfaces:
+                        self.adapter = path
+                        break
             
             if not self.adapter:
                 logger.error("No Bluetooth adapter found")
@@ -322,26 +631,48 @@ p2p_go_intent=0
     def on_device_connected(self, path, interfaces):
         """Called when a device connects via Bluetooth."""
         try:
-            if "org.bluez.Device1" in interfaces:
-                device = interfaces["org.bluez.Device1"]
-                device_name = device.get("Name", "Unknown Device")
-                device_address = device.get("Address", "Unknown")
+            device = interfaces.get("org.bluez.Device1")
+            if device is not None:
+                device_name = str(device.get("Name", "Unknown Device"))
+                device_address = str(device.get("Address", "Unknown"))
                 
                 logger.info(f"Android device connected: {device_name} ({device_address})")
-                self.connected_devices.add(path)
+                self.connected_devices[device_address] = ConnectedDevice(
+                    str(path), device_name, device_address, time.monotonic())
+                self.device_paths[str(path)] = device_address
                 
-                # Start Android WiFi Direct credential extraction
-                self.extract_wifi_credentials_from_android(device_name, device_address)
+                # Coalesce the burst of signals BlueZ emits on pairing before extracting
+                self.pending_devices[device_address] = device_name
+                if self.pending_source_id is None:
+                    self.pending_source_id = GLib.timeout_add(200, self.flush_pending_devices)
                 
         except Exception as e:
             logger.error(f"Error handling device connection: {e}")
     
+    def flush_pending_devices(self) -> bool:
+        """Hand queued devices to a worker thread so the main loop keeps dispatching."""
+        self.pending_source_id = None
+        pending, self.pending_devices = self.pending_devices, {}
+        threading.Thread(target=self.extract_pending_devices, args=(pending,), daemon=True).start()
+        return False
+    
+    def extract_pending_devices(self, pending: Dict[str, str]):
+        """Run credential extraction for each queued device, one at a time."""
+        with self.extraction_lock:
+            for device_address, device_name in pending.items():
+                if device_address not in self.connected_devices:
+                    logger.info(f"Skipping {device_name} ({device_address}): no longer connected")
+                    continue
+                self.extract_wifi_credentials_from_android(device_name, device_address)
+    
     def on_device_disconnected(self, path, interfaces):
         """Called when a device disconnects from Bluetooth."""
         try:
-            if path in self.connected_devices:
-                logger.info(f"Android device disconnected: {path}")
-                self.connected_devices.remove(path)
+            device_address = self.device_paths.pop(str(path), None)
+            if device_address is not None:
+                device = self.connected_devices.pop(device_address, None)
+                device_name = device.name if device else "Unknown Device"
+                logger.info(f"Android device disconnected: {device_name} ({device_address})")
                 
         except Exception as e:
             logger.error(f"Error handling device disconnection: {e}")
@@ -355,33 +686,41 @@ p2p_go_intent=0
             logger.info(f"Starting Android WiFi Direct credential extraction from {device_name}...")
             logger.info(f"Total timeout: {timeout_seconds} seconds")
             
+            # Listen for wpa_supplicant events before starting discovery so
+            # no P2P-DEVICE-FOUND or group events are missed
+            try:
+                self.wpa_events = WpaCtrl()
+                self.wpa_events.attach()
+            except OSError as e:
+                logger.warning(f"Could not attach to wpa_supplicant events: {e}")
+                return False
+            
             # Step 1: Discover Android WiFi Direct devices
             logger.info("Step 1: Discovering Android WiFi Direct devices...")
             try:
-                subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], check=True, timeout=10)
-                logger.info("WiFi Direct discovery started, waiting 15 seconds for Android...")
-                time.sleep(15)  # Android devices need more time to respond
+                if not self.wpa_ok(self.wpa_request('P2P_FIND', timeout=10)):
+                    logger.warning("WiFi Direct discovery failed")
+                    return False
+                logger.info("WiFi Direct discovery started, waiting up to 15 seconds for Android...")
+                discovered_devices = self.wait_for_android_devices(15)  # Android devices need more time to respond
                 
                 # Check timeout
                 if time.time() - start_time > timeout_seconds:
                     logger.warning("Timeout reached during discovery")
                     return False
                     
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            except OSError:
                 logger.warning("WiFi Direct discovery failed")
                 return False
             
             # Step 2: Get list of discovered Android devices
             logger.info("Step 2: Getting list of discovered Android devices...")
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                  capture_output=True, text=True, check=True)
+            if not discovered_devices:
+                # Peers found by an earlier discovery are not reported again,
+                # so fall back to the peer table
+                discovered_devices = self.parse_android_devices(self.iter_p2p_peers())
             
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("Android WiFi Direct devices discovered:")
-                logger.info(result.stdout)
-                
-                # Parse discovered Android devices
-                discovered_devices = self.parse_android_devices(result.stdout)
+            if discovered_devices:
                 logger.info(f"Found {len(discovered_devices)} Android WiFi Direct devices")
                 
                 # Step 3: Try to connect to each discovered Android device
@@ -421,34 +760,56 @@ p2p_go_intent=0
             logger.error(f"Error in Android WiFi Direct credential extraction: {e}")
             return False
         finally:
+            if self.wpa_events:
+                self.wpa_events.close()
+                self.wpa_events = None
             elapsed_time = time.time() - start_time
             logger.info(f"Android WiFi Direct extraction completed in {elapsed_time:.1f} seconds")
     
-    def parse_android_devices(self, peers_output: str) -> list:
-        """Parse the output of p2p_peers to extract Android device information."""
+    def wait_for_android_devices(self, timeout: float) -> list:
+        """Wait for P2P-DEVICE-FOUND events and return the reported devices."""
+        devices = []
+        event = self.wpa_events.wait_for_event(('P2P-DEVICE-FOUND',), timeout)
+        
+        while event:
+            device = self.parse_android_device_event(event)
+            if device and device not in devices:
+                devices.append(device)
+            # Collect other phones answering the same discovery round
+            event = self.wpa_events.wait_for_event(('P2P-DEVICE-FOUND',), 1)
+        
+        return devices
+    
+    def parse_android_device_event(self, event: str) -> Optional[Dict[str, str]]:
+        """Parse a P2P-DEVICE-FOUND event into an Android device dict."""
+        match = _EVENT_ADDR_RE.match(event)
+        if not match:
+            return None
+        
+        device = {'address': match.group(1)}
+        for key, value in _EVENT_FIELD_RE.findall(event):
+            device[_EVENT_FIELDS[key]] = value.strip("'")
+        
+        logger.info(f"  - {device.get('name', 'Unknown')} ({device['address']})")
+        return device
+    
+    def parse_android_devices(self, peer_blocks) -> list:
+        """Parse P2P_PEER replies one at a time to extract Android device information."""
         devices = []
+        peer_block = ''
         try:
-            lines = peers_output.strip().split('\n')
-            current_device = {}
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('dev_addr='):
-                    if current_device and 'address' in current_device:
+            current_device = None
+            
+            for peer_block in peer_blocks:
+                logger.debug(f"P2P peer details:\n{peer_block}")
+                for match in _PEER_RE.finditer(peer_block):
+                    address, key, value = match.groups()
+                    if address:
+                        # Each peer block starts with its P2P device address
+                        current_device = {'address': address}
                         devices.append(current_device)
-                    current_device = {'address': line.split('=', 1)[1]}
-                elif line.startswith('dev_name='):
-                    current_device['name'] = line.split('=', 1)[1]
-                elif line.startswith('p2p_dev_addr='):
-                    current_device['p2p_address'] = line.split('=', 1)[1]
-                elif line.startswith('p2p_go_intent='):
-                    current_device['go_intent'] = line.split('=', 1)[1]
-                elif line.startswith('p2p_dev_capab='):
-                    current_device['capabilities'] = line.split('=', 1)[1]
-            
-            # Add the last device if it has an address
-            if current_device and 'address' in current_device:
-                devices.append(current_device)
+                    elif current_device is not None:
+                        current_device[_PEER_FIELDS[key]] = value
             
             logger.info(f"Parsed {len(devices)} Android devices from discovery output")
             for device in devices:
@@ -456,7 +817,7 @@ p2p_go_intent=0
                 
         except Exception as e:
             logger.error(f"Error parsing Android devices: {e}")
-            logger.error(f"Raw output was: {peers_output}")
+            logger.error(f"Raw output was: {peer_block}")
         
         return devices
     
@@ -467,29 +828,34 @@ p2p_go_intent=0
             
             # Try to connect using device address with PBC (Push Button Configuration)
             logger.info("Initiating P2P connection with PBC (Android compatible)...")
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_connect', device_address, 'pbc'], 
-                                  capture_output=True, text=True, check=True)
+            result = self.wpa_request(f'P2P_CONNECT {device_address} pbc')
             
-            if result.returncode == 0:
+            if self.wpa_ok(result):
                 logger.info("Android WiFi Direct connection initiated!")
-                logger.info(f"Connection output: {result.stdout}")
+                logger.info("Connection output: %s", result)
                 
-                # Wait for connection with progress updates (Android devices may take longer)
-                logger.info("Waiting for Android connection to establish...")
-                for i in range(45):  # Wait up to 45 seconds for Android
-                    time.sleep(1)
-                    if i % 5 == 0:  # Progress update every 5 seconds
-                        logger.info(f"Android connection attempt in progress... ({i+1}/45 seconds)")
-                    
-                    # Check connection status
+                # Wait for the group to form (Android devices may take longer)
+                logger.info("Waiting up to 45 seconds for Android connection to establish...")
+                event = self.wpa_events.wait_for_event(
+                    ('P2P-GROUP-STARTED', 'P2P-GO-NEG-FAILURE', 'P2P-GROUP-FORMATION-FAILURE'), 45)
+                
+                if event is None:
+                    # Confirm the status in case the group event was missed
                     if self.check_android_wifi_direct_connection():
                         logger.info("Android WiFi Direct connection established!")
                         return self.extract_credentials_from_android_wifi_direct()
+                    logger.warning("Android connection attempt timed out after 45 seconds")
+                    return False
                 
-                logger.warning("Android connection attempt timed out after 45 seconds")
+                if event.startswith('P2P-GROUP-STARTED'):
+                    logger.info("Android WiFi Direct connection established!")
+                    logger.info(f"Group event: {event}")
+                    return self.extract_credentials_from_android_wifi_direct()
+                
+                logger.warning(f"Android connection attempt failed: {event}")
                 return False
             else:
-                logger.error(f"Failed to initiate Android connection: {result.stderr}")
+                logger.error(f"Failed to initiate Android connection: {result.strip()}")
                 return False
             
         except Exception as e:
@@ -505,13 +871,13 @@ p2p_go_intent=0
             logger.info("Method 1: Android WiFi Direct service discovery...")
             
             # Send service discovery request (Android compatible)
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_req', 
-                                   device_address, '02000001'], 
-                                  capture_output=True, text=True, check=True)
+            result = self.wpa_request(f'P2P_SERV_DISC_REQ {device_address} 02000001')
             
-            if result.returncode == 0:
+            if self.wpa_ok(result):
                 logger.info("Android service discovery request sent")
-                time.sleep(10)  # Android devices need more time
+                # Android devices need more time, but stop waiting once one answers
+                if not self.wpa_events.wait_for_event(('P2P-SERV-DISC-RESP',), 10):
+                    logger.info("No service discovery response within 10 seconds")
                 
                 # Check for service responses
                 if self.check_for_android_service_responses():
@@ -521,12 +887,13 @@ p2p_go_intent=0
             logger.info("Method 2: Android WiFi Direct group formation...")
             
             # Try to form a group with the Android device
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_group_add'], 
-                                  capture_output=True, text=True, check=True)
+            result = self.wpa_request('P2P_GROUP_ADD')
             
-            if result.returncode == 0:
+            if self.wpa_ok(result):
                 logger.info("Android WiFi Direct group formation initiated")
-                time.sleep(15)  # Wait for group formation
+                # Wait for group formation to finish either way
+                self.wpa_events.wait_for_event(
+                    ('P2P-GROUP-STARTED', 'P2P-GROUP-FORMATION-FAILURE'), 15)
                 
                 # Check group status
                 if self.check_android_group_status():
@@ -544,19 +911,17 @@ p2p_go_intent=0
     def check_android_wifi_direct_connection(self) -> bool:
         """Check if Android WiFi Direct connection is established."""
         try:
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
+            status = self.get_wpa_status()
             
-            if result.returncode == 0:
-                status = result.stdout
-                logger.debug(f"Current Android wpa_supplicant status: {status}")
+            if self.wpa_ok(status):
+                logger.debug("Current Android wpa_supplicant status: %s", status)
                 
                 if 'p2p_go_mode=1' in status or 'p2p_client_mode=1' in status:
                     logger.info("Android WiFi Direct connection established!")
                     return True
                 elif 'p2p' in status.lower():
                     logger.info("Android WiFi Direct is active but not fully connected")
-                    logger.info(f"P2P status: {status}")
+                    logger.info("P2P status: %s", status)
                     return False
                 else:
                     logger.debug("No Android WiFi Direct activity detected")
@@ -572,15 +937,13 @@ p2p_go_intent=0
         """Check for Android WiFi Direct service responses."""
         try:
             # Check for service responses
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_resp'], 
-                                  capture_output=True, text=True, check=False)
+            result = self.wpa_request('P2P_SERV_DISC_RESP')
             
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("Android service discovery responses received:")
-                logger.info(result.stdout)
+            if self.wpa_ok(result) and result.strip():
+                _dump("Android service discovery responses received:", result)
                 return True
-            elif result.returncode != 0:
-                logger.info(f"Service discovery response check returned {result.returncode}: {result.stderr}")
+            elif not self.wpa_ok(result):
+                logger.info(f"Service discovery response check returned: {result.strip()}")
             
             return False
             
@@ -592,19 +955,17 @@ p2p_go_intent=0
         """Check Android WiFi Direct group status."""
         try:
             # Check group information
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_group_info'], 
-                                  capture_output=True, text=True, check=False)
+            result = self.wpa_request('P2P_GROUP_INFO')
             
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("Android WiFi Direct group status:")
-                logger.info(result.stdout)
+            if self.wpa_ok(result) and result.strip():
+                _dump("Android WiFi Direct group status:", result)
                 
                 # Look for group formation success
-                if 'group_id=' in result.stdout:
+                if 'group_id=' in result:
                     logger.info("Android WiFi Direct group formed successfully!")
                     return True
-            elif result.returncode != 0:
-                logger.info(f"Group status check returned {result.returncode}: {result.stderr}")
+            elif not self.wpa_ok(result):
+                logger.info(f"Group status check returned: {result.strip()}")
             
             return False
             
@@ -618,25 +979,24 @@ p2p_go_intent=0
             logger.info("Attempting direct Android credential extraction...")
             
             # Try to get Android device information
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peer', device_address], 
-                                  capture_output=True, text=True, check=True)
+            result = self.wpa_request(f'P2P_PEER {device_address}')
             
-            if result.returncode == 0:
-                logger.info("Android device information retrieved:")
-                logger.info(result.stdout)
+            if self.wpa_ok(result):
+                _dump("Android device information retrieved:", result)
                 
                 # Look for network information in Android device details
-                if self.parse_android_network_info(result.stdout):
+                if self.parse_android_network_info(result):
                     return True
             
             # Try to request specific network information from Android
             logger.info("Requesting specific network information from Android...")
             
             # Send network query request (Android compatible)
-            subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_req', 
-                          device_address, '02000001'], check=True)
+            if not self.wpa_ok(self.wpa_request(f'P2P_SERV_DISC_REQ {device_address} 02000001')):
+                return False
             
-            time.sleep(10)  # Android devices need more time
+            # Android devices need more time, but stop waiting once one answers
+            self.wpa_events.wait_for_event(('P2P-SERV-DISC-RESP',), 10)
             
             # Check for network information
             if self.check_for_android_network_info():
@@ -651,13 +1011,11 @@ p2p_go_intent=0
     def parse_android_network_info(self, device_info: str) -> bool:
         """Parse network information from Android device details."""
         try:
-            # Look for Android-specific network information
-            android_network_indicators = ['network', 'ssid', 'wifi', 'hotspot', 'tethering']
-            
-            for indicator in android_network_indicators:
-                if indicator in device_info.lower():
-                    logger.info(f"Android network information found: {indicator}")
-                    return True
+            # Look for Android-specific network information in a single pass
+            match = _ANDROID_NET_RE.search(device_info)
+            if match:
+                logger.info(f"Android network information found: {match.group(0).lower()}")
+                return True
             
             return False
             
@@ -670,22 +1028,19 @@ p2p_go_intent=0
         try:
             # Check various sources for Android network information
             sources = [
-                ['sudo', 'wpa_cli', 'p2p_peers'],
-                ['sudo', 'wpa_cli', 'status'],
-                ['sudo', 'wpa_cli', 'list_networks']
+                ('p2p_peers', self.get_p2p_peers),
+                ('status', self.get_wpa_status),
+                ('list_networks', lambda: self.wpa_request('LIST_NETWORKS'))
             ]
             
-            for source in sources:
+            for source, query in sources:
                 try:
-                    result = subprocess.run(source, capture_output=True, text=True, check=True)
-                    if result.returncode == 0 and result.stdout.strip():
-                        android_indicators = ['network', 'ssid', 'wifi', 'android', 'p2p']
-                        for indicator in android_indicators:
-                            if indicator in result.stdout.lower():
-                                logger.info(f"Android network information found in {source[-1]}:")
-                                logger.info(result.stdout)
-                                return True
-                except:
+                    output = query()
+                    if self.wpa_ok(output) and _IND_RE.search(output):
+                        logger.info(f"Android network information found in {source}")
+                        logger.debug("%s output:\n%s", source, output)
+                        return True
+                except OSError:
                     continue
             
             return False
@@ -700,13 +1055,10 @@ p2p_go_intent=0
             logger.info("Extracting credentials from Android WiFi Direct connection...")
             
             # Get connection information
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
+            status = self.get_wpa_status()
             
-            if result.returncode == 0:
-                status = result.stdout
-                logger.info("Android WiFi Direct connection status:")
-                logger.info(status)
+            if self.wpa_ok(status):
+                _dump("Android WiFi Direct connection status:", status)
                 
                 # Look for network information
                 if self.extract_android_network_credentials(status):
@@ -722,18 +1074,11 @@ p2p_go_intent=0
         """Extract network credentials from Android WiFi Direct status."""
         try:
             # Parse status for Android network information
-            lines = status.split('\n')
-            network_info = {}
-            
-            for line in lines:
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    network_info[key.strip()] = value.strip()
+            network_info = dict(line.split('=', 1) for line in status.splitlines() if '=' in line)
             
             # Look for Android network credentials
             if 'ssid' in network_info or 'psk' in network_info:
                 logger.info("Android network credentials found!")
-                logger.info(f"Network info: {network_info}")
                 
                 # Extract SSID and password
                 ssid = network_info.get('ssid', 'Unknown')
@@ -741,13 +1086,12 @@ p2p_go_intent=0
                 
                 if ssid != 'Unknown' and password != 'Unknown':
                     logger.info(f"Android WiFi credentials extracted via WiFi Direct!")
-                    logger.info(f"SSID: {ssid}")
-                    logger.info(f"Password: {password}")
+                    logger.info("SSID: %s", ssid)
+                    logger.info("Password: %s", "*" * len(password))
                     
-                    # Save credentials
-                    credentials = {'ssid': ssid, 'password': password}
-                    with open(self.config_file, 'w') as f:
-                        json.dump(credentials, f)
+                    # Save credentials durably and readable by root only
+                    _atomic_write(str(self.config_file), _CREDENTIALS_TEMPLATE.format(
+                        ssid=json.dumps(ssid), password=json.dumps(password)), mode=0o600)
                     
                     self.credentials_received = True
                     
@@ -770,40 +1114,53 @@ p2p_go_intent=0
         try:
             logger.info(f"Connecting to extracted network: {ssid}")
             
-            # Stop WiFi Direct services
-            subprocess.run(['sudo', 'wpa_cli', 'p2p_stop_find'], check=True)
-            subprocess.run(['sudo', 'killall', 'wpa_supplicant'], check=True)
+            psk = _wpa_psk(ssid, password)
+            if psk is None:
+                logger.warning("Extracted password is neither a WPA passphrase nor a raw PSK")
+                return False
             
-            # Create standard WiFi client configuration
+            # Create standard WiFi client configuration; the SSID is hex-encoded
+            # and the PSK is raw hex, so neither needs quoting
             wpa_config = f"""
 ctrl_interface=/var/run/wpa_supplicant
 ctrl_interface_group=0
 update_config=1
 
 network={{
-    ssid="{ssid}"
-    psk="{password}"
+    ssid={ssid.encode().hex()}
+    psk={psk}
     key_mgmt=WPA-PSK
     scan_ssid=1
 }}
 """
             
-            with open('/tmp/wpa_supplicant_client.conf', 'w') as f:
-                f.write(wpa_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant_client.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
-            
-            # Start wpa_supplicant in client mode
-            subprocess.run(['sudo', 'wpa_supplicant', '-B', '-i', 'wlan0', 
-                          '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
-                          '-D', 'nl80211'], check=True)
+            # The config holds the PSK, so keep it readable by root only. Writing
+            # it ourselves instead of SAVE_CONFIG keeps that mode
+            _atomic_write('/etc/wpa_supplicant/wpa_supplicant.conf', wpa_config, mode=0o600)
             
-            # Wait for connection
-            time.sleep(10)
+            # Stop WiFi Direct services and switch the running wpa_supplicant
+            # over to the client network
+            try:
+                self.wpa_request('P2P_STOP_FIND')
+                switched = self.switch_network(ssid, psk)
+            except OSError as e:
+                logger.warning(f"Could not reconfigure running wpa_supplicant: {e}")
+                switched = False
+            self.status_cache.clear()
+            
+            if not switched:
+                logger.info("Restarting wpa_supplicant with the client configuration...")
+                self.close_wpa()
+                # wpa_supplicant may not be running at all at this point
+                subprocess.run(['killall', 'wpa_supplicant'], stdout=_DN, stderr=_DN, check=False)
+                
+                # Start wpa_supplicant in client mode
+                subprocess.run(['wpa_supplicant', '-B', '-i', 'wlan0', 
+                              '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
+                              '-D', 'nl80211'], check=True)
             
-            # Check connection status
-            if self.check_wifi_connection():
+            # Wait for association instead of sleeping a fixed time
+            if self.wait_for_wifi_connection(20) and self.check_wifi_connection():
                 logger.info("Successfully connected to WiFi network!")
                 return True
             else:
@@ -814,23 +1171,74 @@ network={{
             logger.error(f"Error connecting to extracted network: {e}")
             return False
     
+    def switch_network(self, ssid: str, psk: str) -> bool:
+        """Replace the configured networks of the running wpa_supplicant with ssid."""
+        self.wpa_request('P2P_GROUP_REMOVE *')
+        self.wpa_request('REMOVE_NETWORK all')
+        network_id = self.wpa_request('ADD_NETWORK').strip()
+        if not network_id.isdigit():
+            logger.warning(f"ADD_NETWORK failed: {network_id}")
+            return False
+        
+        # The SSID is sent hex-encoded and the PSK as raw hex, so no character needs quoting.
+        # No SAVE_CONFIG: wpa_supplicant would rewrite the config without its 0600 mode
+        commands = [
+            f'SET_NETWORK {network_id} ssid {ssid.encode().hex()}',
+            f'SET_NETWORK {network_id} psk {psk}',
+            f'SET_NETWORK {network_id} key_mgmt WPA-PSK',
+            f'SET_NETWORK {network_id} scan_ssid 1',
+            f'ENABLE_NETWORK {network_id}',
+            f'SELECT_NETWORK {network_id}'
+        ]
+        replies = self.wpa_request_many(commands)
+        for command, reply in zip(commands, replies):
+            if not reply.startswith('OK'):
+                # Log the command without the PSK
+                logger.warning(f"{command.split(' psk ', 1)[0]} failed: {reply.strip()}")
+                return False
+        
+        return True
+    
+    def wait_for_wifi_connection(self, timeout: float) -> bool:
+        """Wait for wpa_supplicant to report CTRL-EVENT-CONNECTED or a rejection."""
+        wpa_ctrl_path = os.path.join(WPA_CTRL_DIR, 'wlan0')
+        if not _wait_for(lambda: os.path.exists(wpa_ctrl_path), 10):
+            logger.warning("wpa_supplicant control socket did not appear in time")
+            return False
+        
+        events = WpaCtrl()
+        try:
+            events.attach()
+            
+            # Association may already have completed before ATTACH
+            if 'wpa_state=COMPLETED' in events.request('STATUS'):
+                return True
+            
+            event = events.wait_for_event(
+                ('CTRL-EVENT-CONNECTED', 'CTRL-EVENT-ASSOC-REJECT', 'CTRL-EVENT-SSID-TEMP-DISABLED'),
+                timeout)
+            if event is None:
+                logger.warning(f"No connection event within {timeout} seconds")
+                return False
+            
+            logger.info(f"wpa_supplicant event: {event.strip()}")
+            return event.startswith('CTRL-EVENT-CONNECTED')
+            
+        finally:
+            events.close()
+    
     def check_wifi_connection(self) -> bool:
         """Check if WiFi connection is established."""
         try:
-            result = subprocess.run(['iwconfig', 'wlan0'], 
-                                  capture_output=True, text=True, check=True)
-            
-            if result.returncode == 0:
-                output = result.stdout
-                if 'ESSID:' in output and 'Not-Associated' not in output:
-                    logger.info("WiFi connection established!")
-                    logger.info(f"Connection status: {output}")
-                    return True
-                else:
-                    logger.info("WiFi not yet connected")
-                    return False
+            essid, _ = self.get_wireless_state()
             
-            return False
+            if essid:
+                logger.info("WiFi connection established!")
+                logger.info("Connected to ESSID: %s", essid)
+                return True
+            else:
+                logger.info("WiFi not yet connected")
+                return False
             
         except Exception as e:
             logger.error(f"Error checking WiFi connection: {e}")
@@ -840,37 +1248,35 @@ network={{
         """Debug the current Android WiFi Direct state."""
         logger.info("🔍 Debugging Android WiFi Direct state...")
         
+        ip_addr = None
         try:
+            # Start listing network interfaces now so it runs while we query wpa_supplicant
+            ip_addr = subprocess.Popen(['ip', 'addr', 'show'], stdout=subprocess.PIPE,
+                                       stderr=_DN, text=True)
+            
+            # Query status, the first peer and groups in one round trip
+            status, first_peer, groups = self.wpa_request_many(
+                ['STATUS', 'P2P_PEER FIRST', 'P2P_GROUP_INFO'])
+            
             # Check wpa_supplicant status
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                logger.info("WPA Status:")
-                logger.info(result.stdout)
+            _dump("WPA Status:", status)
             
             # Check P2P peers
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                logger.info("P2P Peers:")
-                logger.info(result.stdout)
+            _dump("P2P Peers:", lambda: ''.join(self.iter_p2p_peers(first_peer)))
             
             # Check P2P groups
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_group_info'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                logger.info("P2P Groups:")
-                logger.info(result.stdout)
+            _dump("P2P Groups:", groups)
             
             # Check network interfaces
-            result = subprocess.run(['ip', 'addr', 'show'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                logger.info("Network Interfaces:")
-                logger.info(result.stdout)
+            output, _ = ip_addr.communicate(timeout=10)
+            if ip_addr.returncode == 0:
+                _dump("Network Interfaces:", output)
                 
         except Exception as e:
             logger.error(f"Error getting Android WiFi Direct status: {e}")
+            if ip_addr and ip_addr.poll() is None:
+                ip_addr.kill()
+                ip_addr.wait()
         
         logger.info("🔍 Android WiFi Direct debug complete")
     
@@ -878,29 +1284,26 @@ network={{
         """Check if WiFi interface is available and not busy."""
         try:
             # Check if wlan0 exists
-            result = subprocess.run(['ip', 'link', 'show', 'wlan0'], 
-                                  capture_output=True, text=True, check=False)
-            
-            if result.returncode != 0:
+            if not os.path.exists('/sys/class/net/wlan0'):
                 logger.error("wlan0 interface not found")
                 return False
             
             # Check if interface is up
-            if 'UP' not in result.stdout:
+            if not _interface_is_up('wlan0'):
                 logger.warning("wlan0 interface is down")
                 return False
             
             # Check if interface is busy
-            result = subprocess.run(['iwconfig', 'wlan0'], 
-                                  capture_output=True, text=True, check=False)
-            
-            if result.returncode == 0:
-                if 'ESSID:' in result.stdout and 'Not-Associated' not in result.stdout:
+            try:
+                essid, mode = self.get_wireless_state()
+                if essid:
                     logger.warning("wlan0 is currently connected to a network")
                     return False
-                elif 'Mode:' in result.stdout and 'Master' in result.stdout:
+                elif mode == IW_MODE_MASTER:
                     logger.warning("wlan0 is currently in AP mode")
                     return False
+            except OSError as e:
+                logger.debug("Could not read wireless state of wlan0: %s", e)
             
             logger.info("WiFi interface status check passed")
             return True
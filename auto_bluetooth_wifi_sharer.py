@@ -14,6 +14,11 @@ import os
 import sys
 import time
 import json
+import array
+import fcntl
+import socket
+import struct
+import tempfile
 import subprocess
 import logging
 import dbus
@@ -41,19 +46,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Config file templates, filled in with bytes values at write time
+_BLUETOOTH_CONF_TEMPLATE = b"""
+[General]
+Name = %s
+Class = 0x000100
+DiscoverableTimeout = 0
+PairableTimeout = 0
+AutoEnable = true
+
+[Policy]
+AutoEnable = true
+
+[GATT]
+Key = 0000110b-0000-1000-8000-00805f9b34fb
+"""
+
+_WPA_CONF_TEMPLATE = b"""
+ctrl_interface=/var/run/wpa_supplicant
+ctrl_interface_group=0
+update_config=1
+
+network={
+    ssid="%s"
+    psk="%s"
+    key_mgmt=WPA-PSK
+    scan_ssid=1
+}
+"""
+
+# Wireless extensions ioctl used to read the associated ESSID without iwconfig
+SIOCGIWESSID = 0x8B1B
+IW_ESSID_MAX_SIZE = 32
+_IWREQ_POINT = struct.Struct('16sPHH')
+
+def _current_essid(interface: str) -> str:
+    """Return the ESSID interface is associated with, or '' if none."""
+    essid = array.array('B', bytes(IW_ESSID_MAX_SIZE + 1))
+    iwreq = _IWREQ_POINT.pack(interface.encode(), essid.buffer_info()[0], len(essid), 0).ljust(32, b'\0')
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        length = _IWREQ_POINT.unpack_from(fcntl.ioctl(s, SIOCGIWESSID, iwreq))[2]
+    return essid.tobytes()[:length].rstrip(b'\0').decode(errors='replace')
+
+def _atomic_write(path: str, content: bytes, mode: int = 0o644):
+    """Atomically replace path with content via a temp file in the same directory."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.write(fd, content)
+        os.fchmod(fd, mode)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+def _set_device_info(service, device_info):
+    """Store device_info on service along with its compact JSON encoding."""
+    if "connected_at_epoch" in device_info:
+        device_info = dict(device_info)
+        device_info["connected_at"] = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(device_info.pop("connected_at_epoch")))
+    service.device_info = device_info
+    service.device_info_bytes = json.dumps(device_info, separators=(',', ':')).encode('utf-8')
+
 if DBUS_SERVICE_AVAILABLE:
     class WiFiCredentialService(dbus.service.Object):
         """Bluetooth GATT service for WiFi credential extraction."""
         
-        def __init__(self, bus, path):
+        def __init__(self, bus, path, sharer=None):
             dbus.service.Object.__init__(self, bus, path)
             self.bus = bus
             self.path = path
+            self.sharer = sharer
             
             # WiFi credential characteristics
             self.wifi_ssid = "Unknown"
             self.wifi_password = "Unknown"
+            # Bit 0 is set once the SSID has been written, bit 1 the password
+            self.creds_mask = 0
             self.device_info = {}
+            self.device_info_bytes = b'{}'
+            
+        def set_device_info(self, device_info):
+            """Replace the device information and its encoded GATT value."""
+            _set_device_info(self, device_info)
             
         @dbus.service.method("org.bluez.GattService1",
                              in_signature="", out_signature="")
@@ -77,15 +156,19 @@ if DBUS_SERVICE_AVAILABLE:
         def ReadValue(self):
             """Read WiFi SSID value."""
             logger.info("Reading WiFi SSID")
-            return [ord(c) for c in self.service.wifi_ssid]
+            return dbus.ByteArray(self.service.wifi_ssid.encode('utf-8'))
             
         @dbus.service.method("org.bluez.GattCharacteristic1",
-                             in_signature="ay", out_signature="")
+                             in_signature="ay", out_signature="",
+                             byte_arrays=True)
         def WriteValue(self, value):
             """Write WiFi SSID value."""
-            ssid = ''.join([chr(b) for b in value])
-            logger.info(f"WiFi SSID written: {ssid}")
+            ssid = bytes(value).decode('utf-8', errors='replace')
+            logger.info("WiFi SSID written: %s", ssid)
             self.service.wifi_ssid = ssid
+            self.service.creds_mask |= 1
+            if self.service.sharer:
+                self.service.sharer.schedule_credentials_check()
 
     class WiFiPasswordCharacteristic(dbus.service.Object):
         """GATT characteristic for WiFi password."""
@@ -99,15 +182,19 @@ if DBUS_SERVICE_AVAILABLE:
         def ReadValue(self):
             """Read WiFi password value."""
             logger.info("Reading WiFi password")
-            return [ord(c) for c in self.service.wifi_password]
+            return dbus.ByteArray(self.service.wifi_password.encode('utf-8'))
             
         @dbus.service.method("org.bluez.GattCharacteristic1",
-                             in_signature="ay", out_signature="")
+                             in_signature="ay", out_signature="",
+                             byte_arrays=True)
         def WriteValue(self, value):
             """Write WiFi password value."""
-            password = ''.join([chr(b) for b in value])
-            logger.info(f"WiFi password written: {password}")
+            password = bytes(value).decode('utf-8', errors='replace')
+            logger.info("WiFi password written (%d characters)", len(password))
             self.service.wifi_password = password
+            self.service.creds_mask |= 2
+            if self.service.sharer:
+                self.service.sharer.schedule_credentials_check()
 
     class DeviceInfoCharacteristic(dbus.service.Object):
         """GATT characteristic for device information."""
@@ -121,20 +208,29 @@ if DBUS_SERVICE_AVAILABLE:
         def ReadValue(self):
             """Read device information."""
             logger.info("Reading device information")
-            info = json.dumps(self.service.device_info)
-            return [ord(c) for c in info]
+            return dbus.ByteArray(self.service.device_info_bytes)
 
 else:
     # Fallback classes when dbus.service is not available
     class WiFiCredentialService:
         """Fallback WiFi credential service."""
         
-        def __init__(self, bus, path):
+        __slots__ = ('bus', 'path', 'sharer', 'wifi_ssid', 'wifi_password',
+                     'creds_mask', 'device_info', 'device_info_bytes')
+        
+        def __init__(self, bus, path, sharer=None):
             self.bus = bus
             self.path = path
+            self.sharer = sharer
             self.wifi_ssid = "Unknown"
             self.wifi_password = "Unknown"
+            self.creds_mask = 0
             self.device_info = {}
+            self.device_info_bytes = b'{}'
+            
+        def set_device_info(self, device_info):
+            """Replace the device information and its encoded value."""
+            _set_device_info(self, device_info)
             
         def Start(self):
             logger.info("WiFi Credential Service started (fallback mode)")
@@ -145,6 +241,8 @@ else:
     class WiFiSSIDCharacteristic:
         """Fallback SSID characteristic."""
         
+        __slots__ = ('bus', 'path', 'service')
+        
         def __init__(self, bus, path, service):
             self.bus = bus
             self.path = path
@@ -153,6 +251,8 @@ else:
     class WiFiPasswordCharacteristic:
         """Fallback password characteristic."""
         
+        __slots__ = ('bus', 'path', 'service')
+        
         def __init__(self, bus, path, service):
             self.bus = bus
             self.path = path
@@ -161,6 +261,8 @@ else:
     class DeviceInfoCharacteristic:
         """Fallback device info characteristic."""
         
+        __slots__ = ('bus', 'path', 'service')
+        
         def __init__(self, bus, path, service):
             self.bus = bus
             self.path = path
@@ -173,24 +275,34 @@ class AutoBluetoothWiFiSharer:
         self.mainloop = None
         self.bus = None
         self.adapter = None
+        self.adapter_props = None
         self.connected_devices = set()
         self.wifi_service = None
         self.credentials_received = False
+        self.credentials_check_pending = False
+        self.checking_credentials = False
         
     def check_dependencies(self) -> bool:
         """Check if required system packages are installed."""
         required_packages = ['bluez', 'bluez-tools', 'wpasupplicant', 'python3-dbus', 'python3-gi']
         
-        missing_packages = []
-        for package in required_packages:
-            try:
-                subprocess.run(['dpkg', '-s', package], 
-                             capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                missing_packages.append(package)
+        # Query all packages with a single dpkg-query call. It exits non-zero
+        # when any package is unknown but still prints the others.
+        result = subprocess.run(['dpkg-query', '-W', '-f=${Package}\t${Status}\n',
+                               *required_packages],
+                              capture_output=True, text=True, check=False)
+        
+        installed_packages = set()
+        for line in result.stdout.splitlines():
+            package, _, status = line.partition('\t')
+            if status == 'install ok installed':
+                installed_packages.add(package)
+        
+        missing_packages = [package for package in required_packages
+                            if package not in installed_packages]
         
         if missing_packages:
-            logger.error(f"Missing packages: {', '.join(missing_packages)}")
+            logger.error("Missing packages: %s", ', '.join(missing_packages))
             logger.info("Install with: sudo apt update && sudo apt install " + 
                        " ".join(missing_packages))
             return False
@@ -204,54 +316,43 @@ class AutoBluetoothWiFiSharer:
     
     def setup_bluetooth(self) -> bool:
         """Setup Bluetooth service for automatic credential extraction."""
+        started = []
         try:
-            # Stop existing Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'stop', 'bluetooth'], 
-                         capture_output=True)
-            
-            # Configure Bluetooth
-            bluetooth_config = f"""
-[General]
-Name = {self.bluetooth_service_name}
-Class = 0x000100
-DiscoverableTimeout = 0
-PairableTimeout = 0
-AutoEnable = true
-
-[Policy]
-AutoEnable = true
-
-[GATT]
-Key = 0000110b-0000-1000-8000-00805f9b34fb
-"""
-            
-            with open('/tmp/bluetooth.conf', 'w') as f:
-                f.write(bluetooth_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/bluetooth.conf', 
-                          '/etc/bluetooth/main.conf'], check=True)
+            # Enabling the unit does not depend on the restart, so run it
+            # alongside stopping the existing Bluetooth service
+            enable = subprocess.Popen(['sudo', 'systemctl', 'enable', 'bluetooth'], 
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            started.append(enable)
+            stop = subprocess.Popen(['sudo', 'systemctl', 'stop', 'bluetooth'], 
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            started.append(stop)
+            
+            # Configure Bluetooth while the service stops; bluetoothd only
+            # reads main.conf at startup
+            bluetooth_config = _BLUETOOTH_CONF_TEMPLATE % self.bluetooth_service_name.encode()
+            
+            _atomic_write('/etc/bluetooth/main.conf', bluetooth_config)
+            stop.wait()
             
             # Start Bluetooth service
             subprocess.run(['sudo', 'systemctl', 'start', 'bluetooth'], 
                          check=True)
-            subprocess.run(['sudo', 'systemctl', 'enable', 'bluetooth'], 
-                         check=True)
-            
-            # Make Pi discoverable and pairable
-            subprocess.run(['sudo', 'bluetoothctl', 'discoverable', 'on'], 
-                         check=True)
-            subprocess.run(['sudo', 'bluetoothctl', 'pairable', 'on'], 
-                         check=True)
+            if enable.wait() != 0:
+                raise subprocess.CalledProcessError(enable.returncode, enable.args)
             
-            # Wait for Bluetooth to be ready
-            time.sleep(3)
+            # bluetooth.service is Type=dbus, so systemctl start has already waited
+            # for bluetoothd to own org.bluez; setup_dbus waits for the adapter
             
             logger.info("Bluetooth service configured successfully")
             return True
             
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to setup Bluetooth: {e}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error("Failed to setup Bluetooth: %s", e)
             return False
+        finally:
+            # Reap the background systemctl calls even if a later step failed
+            for proc in started:
+                proc.wait()
     
     def setup_dbus(self) -> bool:
         """Setup D-Bus connection for Bluetooth monitoring."""
@@ -260,27 +361,107 @@ Key = 0000110b-0000-1000-8000-00805f9b34fb
             self.bus = dbus.SystemBus()
             self.mainloop = GLib.MainLoop()
             
-            # Get Bluetooth adapter
-            manager = dbus.Interface(
-                self.bus.get_object("org.bluez", "/"),
-                "org.freedesktop.DBus.ObjectManager"
-            )
+            # Get Bluetooth adapter, trying the default hci0 before enumerating everything
+            try:
+                adapter_props = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/org/bluez/hci0", introspect=False),
+                    "org.freedesktop.DBus.Properties"
+                )
+                adapter_props.GetAll("org.bluez.Adapter1")
+                self.adapter = "/org/bluez/hci0"
+            except dbus.exceptions.DBusException:
+                adapter_props = None
+                manager = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/", introspect=False),
+                    "org.freedesktop.DBus.ObjectManager"
+                )
+                
+                for path, interfaces in manager.GetManagedObjects().items():
+                    if "org.bluez.Adapter1" in interfaces:
+                        self.adapter = path
+                        break
             
-            objects = manager.GetManagedObjects()
-            for path, interfaces in objects.items():
-                if "org.bluez.Adapter1" in interfaces:
-                    self.adapter = path
-                    break
+            if not self.adapter:
+                # bluetoothd may still be registering the controller
+                self.adapter = self.wait_for_adapter(5)
             
             if not self.adapter:
                 logger.error("No Bluetooth adapter found")
                 return False
             
+            # Keep the adapter's Properties proxy for every later call, reusing
+            # the one from the hci0 probe when that found the adapter
+            if adapter_props is None:
+                adapter_props = dbus.Interface(
+                    self.bus.get_object("org.bluez", self.adapter, introspect=False),
+                    "org.freedesktop.DBus.Properties"
+                )
+            self.adapter_props = adapter_props
+            
             logger.info("D-Bus connection established")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to setup D-Bus: {e}")
+            logger.error("Failed to setup D-Bus: %s", e)
+            return False
+    
+    def wait_for_adapter(self, timeout: int) -> Optional[str]:
+        """Wait for BlueZ to announce an adapter, dispatching D-Bus events meanwhile."""
+        wait_loop = GLib.MainLoop()
+        adapter_state = {'path': None}
+        
+        def on_interfaces_added(path, interfaces):
+            if "org.bluez.Adapter1" in interfaces:
+                adapter_state['path'] = str(path)
+                wait_loop.quit()
+        
+        adapter_match = self.bus.add_signal_receiver(
+            on_interfaces_added,
+            signal_name="InterfacesAdded",
+            dbus_interface="org.freedesktop.DBus.ObjectManager",
+            bus_name="org.bluez",
+            path="/"
+        )
+        
+        try:
+            # Catch an adapter registered before we subscribed
+            manager = dbus.Interface(
+                self.bus.get_object("org.bluez", "/", introspect=False),
+                "org.freedesktop.DBus.ObjectManager"
+            )
+            for path, interfaces in manager.GetManagedObjects().items():
+                if "org.bluez.Adapter1" in interfaces:
+                    return str(path)
+            
+            logger.info("Waiting for a Bluetooth adapter...")
+            timeout_id = GLib.timeout_add_seconds(timeout, wait_loop.quit)
+            wait_loop.run()
+            if adapter_state['path']:
+                GLib.source_remove(timeout_id)
+            return adapter_state['path']
+        finally:
+            adapter_match.remove()
+    
+    def setup_adapter(self) -> bool:
+        """Power the adapter and make the Pi discoverable and pairable over D-Bus."""
+        try:
+            # Same properties bluetoothctl sets, without spawning it
+            adapter_settings = [
+                ("Powered", dbus.Boolean(True)),
+                ("Alias", dbus.String(self.bluetooth_service_name)),
+                ("DiscoverableTimeout", dbus.UInt32(0)),
+                ("PairableTimeout", dbus.UInt32(0)),
+                ("Pairable", dbus.Boolean(True)),
+                ("Discoverable", dbus.Boolean(True))
+            ]
+            for name, value in adapter_settings:
+                self.adapter_props.Set("org.bluez.Adapter1", name, value)
+            
+            logger.info("Bluetooth adapter is discoverable and pairable")
+            return True
+            
+        except dbus.exceptions.DBusException as e:
+            logger.error("Failed to configure Bluetooth adapter: %s", e)
             return False
     
     def setup_gatt_services(self) -> bool:
@@ -290,12 +471,12 @@ Key = 0000110b-0000-1000-8000-00805f9b34fb
                 logger.warning("Skipping GATT service setup - dbus.service not available")
                 # Create a basic service object for fallback
                 service_path = "/org/bluez/example/service0"
-                self.wifi_service = WiFiCredentialService(self.bus, service_path)
+                self.wifi_service = WiFiCredentialService(self.bus, service_path, self)
                 return True
             
             # Create WiFi credential service
             service_path = "/org/bluez/example/service0"
-            self.wifi_service = WiFiCredentialService(self.bus, service_path)
+            self.wifi_service = WiFiCredentialService(self.bus, service_path, self)
             
             # Create characteristics
             ssid_char_path = "/org/bluez/example/char0"
@@ -318,39 +499,46 @@ Key = 0000110b-0000-1000-8000-00805f9b34fb
             return True
             
         except Exception as e:
-            logger.error(f"Failed to setup GATT services: {e}")
+            logger.error("Failed to setup GATT services: %s", e)
             return False
     
     def setup_bluetooth_monitoring(self) -> bool:
         """Setup monitoring for Bluetooth connections and credential extraction."""
         try:
-            # Monitor for device connections
+            # Monitor for device connections. The match rules restrict delivery
+            # to BlueZ's object manager so the bus daemon drops everything else.
             self.bus.add_signal_receiver(
                 self.on_device_connected,
                 signal_name="InterfacesAdded",
-                dbus_interface="org.freedesktop.DBus.ObjectManager"
+                dbus_interface="org.freedesktop.DBus.ObjectManager",
+                bus_name="org.bluez",
+                path="/"
             )
             
             # Monitor for device disconnections
             self.bus.add_signal_receiver(
                 self.on_device_disconnected,
                 signal_name="InterfacesRemoved",
-                dbus_interface="org.freedesktop.DBus.ObjectManager"
+                dbus_interface="org.freedesktop.DBus.ObjectManager",
+                bus_name="org.bluez",
+                path="/"
             )
             
-            # Monitor for characteristic writes (only if GATT services available)
+            # Monitor for characteristic writes (only if GATT services available),
+            # ignoring adapter and device property churn
             if DBUS_SERVICE_AVAILABLE:
                 self.bus.add_signal_receiver(
                     self.on_characteristic_changed,
                     signal_name="PropertiesChanged",
-                    dbus_interface="org.freedesktop.DBus.Properties"
+                    dbus_interface="org.freedesktop.DBus.Properties",
+                    arg0="org.bluez.GattCharacteristic1"
                 )
             
             logger.info("Bluetooth monitoring setup complete")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to setup Bluetooth monitoring: {e}")
+            logger.error("Failed to setup Bluetooth monitoring: %s", e)
             return False
     
     def on_device_connected(self, path, interfaces):
@@ -361,70 +549,85 @@ Key = 0000110b-0000-1000-8000-00805f9b34fb
                 device_name = device.get("Name", "Unknown Device")
                 device_address = device.get("Address", "Unknown")
                 
-                logger.info(f"Device connected: {device_name} ({device_address})")
+                logger.info("Device connected: %s (%s)", device_name, device_address)
                 self.connected_devices.add(path)
                 
                 # Store device information
                 if self.wifi_service:
-                    self.wifi_service.device_info = {
+                    self.wifi_service.set_device_info({
                         "name": device_name,
                         "address": device_address,
-                        "connected_at": time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                        "connected_at_epoch": time.time()
+                    })
                 
                 # Start monitoring for credential updates
                 self.monitor_credentials()
                 
         except Exception as e:
-            logger.error(f"Error handling device connection: {e}")
+            logger.error("Error handling device connection: %s", e)
     
     def on_device_disconnected(self, path, interfaces):
         """Called when a device disconnects from Bluetooth."""
         try:
             if path in self.connected_devices:
-                logger.info(f"Device disconnected: {path}")
-                self.connected_devices.remove(path)
+                logger.info("Device disconnected: %s", path)
+                # discard() so a repeated InterfacesRemoved signal is harmless
+                self.connected_devices.discard(path)
                 
         except Exception as e:
-            logger.error(f"Error handling device disconnection: {e}")
+            logger.error("Error handling device disconnection: %s", e)
     
     def on_characteristic_changed(self, interface, changed, invalidated):
         """Called when GATT characteristics change."""
         try:
             if "Value" in changed:
                 logger.info("GATT characteristic value changed")
-                self.check_credentials()
+                self.schedule_credentials_check()
                 
         except Exception as e:
-            logger.error(f"Error handling characteristic change: {e}")
+            logger.error("Error handling characteristic change: %s", e)
     
     def monitor_credentials(self):
         """Monitor for WiFi credential updates."""
         try:
             logger.info("Monitoring for WiFi credentials...")
             
-            # Check credentials every 2 seconds
-            while not self.credentials_received and len(self.connected_devices) > 0:
-                self.check_credentials()
-                time.sleep(2)
+            # Later updates are checked as the characteristics are written,
+            # so only pick up credentials written before this device connected
+            self.schedule_credentials_check()
                 
         except Exception as e:
-            logger.error(f"Error monitoring credentials: {e}")
+            logger.error("Error monitoring credentials: %s", e)
+    
+    def schedule_credentials_check(self):
+        """Run check_credentials once from the main loop, coalescing repeated requests."""
+        if self.credentials_check_pending or self.credentials_received:
+            return
+        self.credentials_check_pending = True
+        GLib.idle_add(self.run_credentials_check)
+    
+    def run_credentials_check(self) -> bool:
+        """Idle callback for schedule_credentials_check."""
+        self.credentials_check_pending = False
+        self.check_credentials()
+        return False
     
     def check_credentials(self):
         """Check if we have received WiFi credentials."""
+        if self.checking_credentials:
+            return
+        
+        self.checking_credentials = True
         try:
-            if not self.wifi_service:
+            if not self.wifi_service or self.credentials_received:
                 return
                 
-            if (self.wifi_service.wifi_ssid and 
-                self.wifi_service.wifi_ssid != "Unknown" and
-                self.wifi_service.wifi_password and 
-                self.wifi_service.wifi_password != "Unknown"):
+            # Both the SSID and the password characteristic have been written
+            if self.wifi_service.creds_mask == 3:
                 
                 logger.info("WiFi credentials received via GATT!")
-                logger.info(f"SSID: {self.wifi_service.wifi_ssid}")
-                logger.info(f"Password: {self.wifi_service.wifi_password}")
+                logger.info("SSID: %s", self.wifi_service.wifi_ssid)
+                logger.info("Password: %s", "*" * len(self.wifi_service.wifi_password))
                 
                 self.credentials_received = True
                 
@@ -439,44 +642,79 @@ Key = 0000110b-0000-1000-8000-00805f9b34fb
                     logger.error("Failed to connect to WiFi network")
                     
         except Exception as e:
-            logger.error(f"Error checking credentials: {e}")
+            logger.error("Error checking credentials: %s", e)
+        finally:
+            self.checking_credentials = False
     
     def connect_to_wifi(self, ssid: str, password: str) -> bool:
         """Connect to the specified WiFi network."""
         try:
             # Create wpa_supplicant configuration
-            wpa_config = f"""
-ctrl_interface=/var/run/wpa_supplicant
-ctrl_interface_group=0
-update_config=1
-
-network={{
-    ssid="{ssid}"
-    psk="{password}"
-    key_mgmt=WPA-PSK
-    scan_ssid=1
-}}
-"""
-            
-            with open('/tmp/wpa_supplicant.conf', 'w') as f:
-                f.write(wpa_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
-            
-            # Restart networking
-            subprocess.run(['sudo', 'systemctl', 'restart', 'networking'], 
-                         check=True)
-            
-            # Wait for connection
-            time.sleep(10)
+            wpa_config = _WPA_CONF_TEMPLATE % (ssid.encode(), password.encode())
+            
+            # The config holds the PSK, so keep it readable by root only
+            _atomic_write('/etc/wpa_supplicant/wpa_supplicant.conf', wpa_config, mode=0o600)
+            
+            # Watch wpa_supplicant's state before restarting so no change is missed
+            wait_loop = GLib.MainLoop()
+            connection_state = {'completed': False, 'poll_ms': 250, 'poll_id': None}
+            
+            def on_wpa_properties_changed(properties):
+                if properties.get("State") == "completed":
+                    connection_state['completed'] = True
+                    wait_loop.quit()
+            
+            def poll_association():
+                # A wpa_supplicant started without -u never sends the signal, so
+                # also ask the driver, backing off from 250 ms to 2 s
+                connection_state['poll_id'] = None
+                try:
+                    associated = _current_essid('wlan0') == ssid
+                except OSError as e:
+                    logger.debug("Could not read ESSID of wlan0: %s", e)
+                    associated = False
+                if associated:
+                    connection_state['completed'] = True
+                    wait_loop.quit()
+                else:
+                    connection_state['poll_ms'] = min(connection_state['poll_ms'] * 2, 2000)
+                    connection_state['poll_id'] = GLib.timeout_add(connection_state['poll_ms'],
+                                                                   poll_association)
+                return False
             
-            # Check if connected
-            result = subprocess.run(['iwconfig', 'wlan0'], 
-                                  capture_output=True, text=True)
+            state_match = self.bus.add_signal_receiver(
+                on_wpa_properties_changed,
+                signal_name="PropertiesChanged",
+                dbus_interface="fi.w1.wpa_supplicant1.Interface",
+                bus_name="fi.w1.wpa_supplicant1"
+            )
             
-            if 'ESSID:' in result.stdout and 'off/any' not in result.stdout:
-                logger.info(f"Successfully connected to WiFi: {ssid}")
+            try:
+                # Have the running wpa_supplicant reread its config; only restart
+                # networking (which bounces every interface) if that fails
+                result = subprocess.run(['wpa_cli', '-i', 'wlan0', 'reconfigure'], 
+                                      capture_output=True, text=True)
+                if result.returncode != 0 or 'OK' not in result.stdout:
+                    logger.warning("wpa_cli reconfigure failed, restarting networking")
+                    subprocess.run(['sudo', 'systemctl', 'restart', 'networking'], 
+                                 check=True)
+                
+                # Wait for the connection to complete, up to 30 seconds
+                connection_state['poll_id'] = GLib.timeout_add(connection_state['poll_ms'],
+                                                               poll_association)
+                timeout_id = GLib.timeout_add_seconds(30, wait_loop.quit)
+                wait_loop.run()
+                if not connection_state['completed']:
+                    logger.warning("WiFi connection did not complete within 30 seconds")
+                else:
+                    GLib.source_remove(timeout_id)
+            finally:
+                state_match.remove()
+                if connection_state['poll_id'] is not None:
+                    GLib.source_remove(connection_state['poll_id'])
+            
+            if connection_state['completed']:
+                logger.info("Successfully connected to WiFi: %s", ssid)
                 
                 # Save credentials for future use
                 credentials = {'ssid': ssid, 'password': password}
@@ -488,8 +726,8 @@ network={{
                 logger.error("Failed to connect to WiFi")
                 return False
                 
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error connecting to WiFi: {e}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error("Error connecting to WiFi: %s", e)
             return False
     
     def run(self):
@@ -516,6 +754,11 @@ network={{
                 logger.error("Failed to setup D-Bus")
                 return False
             
+            # Make the adapter discoverable and pairable
+            if not self.setup_adapter():
+                logger.error("Failed to configure Bluetooth adapter")
+                return False
+            
             # Setup GATT services
             if not self.setup_gatt_services():
                 logger.error("Failed to setup GATT services")
@@ -537,20 +780,15 @@ network={{
                 logger.info("3. Pi will detect Bluetooth connections (GATT limited)")
                 logger.info("4. Use alternative credential sharing methods")
             
-            # Start the main loop to monitor for connections
-            if self.mainloop:
-                self.mainloop.run()
-            else:
-                # Fallback: just wait for connections
-                logger.info("Waiting for Bluetooth connections...")
-                while True:
-                    time.sleep(1)
+            # Start the main loop to monitor for connections; every wait from
+            # here on is a GLib source, so signals keep flowing
+            self.mainloop.run()
             
         except KeyboardInterrupt:
             logger.info("Shutting down...")
             return True
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             return False
 
 def main():
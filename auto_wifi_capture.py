@@ -11,54 +11,165 @@ Usage:
 """
 
 import os
+import re
 import sys
 import time
 import json
+import string
+import tempfile
 import subprocess
 import logging
+import logging.handlers
 import dbus
 import dbus.mainloop.glib
 from pathlib import Path
 from typing import Optional, Dict, Any
-from gi.repository import GLib
+from gi.repository import GLib, Gio
 
-# Configure logging
+# Configure logging: file writes are buffered and flushed every 64 records,
+# on any warning or error, and at exit
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_file_handler = logging.FileHandler('/var/log/auto_wifi_capture.log')
+_log_file_handler.setFormatter(_log_formatter)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('/var/log/auto_wifi_capture.log'),
+        logging.handlers.MemoryHandler(64, flushLevel=logging.WARNING,
+                                       target=_log_file_handler),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# DHCP leases handed out by dnsmasq to devices on the hotspot
+DNSMASQ_LEASES = '/var/lib/misc/dnsmasq.leases'
+
+# Config file templates; the per-instance values are filled in once in __init__
+_BLUETOOTH_CONF_TEMPLATE = string.Template("""
+[General]
+Name = $name
+Class = 0x000100
+DiscoverableTimeout = 0
+PairableTimeout = 0
+AutoEnable = true
+
+[Policy]
+AutoEnable = true
+""")
+
+_HOSTAPD_CONF_TEMPLATE = string.Template("""
+interface=wlan0
+driver=nl80211
+ssid=$ssid
+hw_mode=g
+channel=7
+wmm_enabled=0
+macaddr_acl=0
+auth_algs=1
+ignore_broadcast_ssid=0
+wpa=2
+wpa_passphrase=$passphrase
+wpa_key_mgmt=WPA-PSK
+wpa_pairwise=TKIP
+rsn_pairwise=CCMP
+""")
+
+_DNSMASQ_CONF = b"""
+interface=wlan0
+dhcp-range=192.168.4.2,192.168.4.20,255.255.255.0,24h
+dhcp-option=3,192.168.4.1
+dhcp-option=6,192.168.4.1
+server=8.8.8.8
+server=8.8.4.4
+log-queries
+log-dhcp
+listen-address=192.168.4.1
+address=/#/192.168.4.1
+"""
+
+_INTERFACES_CONF = b"""
+auto lo
+iface lo inet loopback
+
+auto wlan0
+iface wlan0 inet static
+    address 192.168.4.1
+    netmask 255.255.255.0
+    network 192.168.4.0
+    broadcast 192.168.4.255
+"""
+
+def _atomic_write(path: str, content: bytes, mode: int = 0o644) -> bool:
+    """Atomically replace path with content, skipping the write if it is unchanged.
+    
+    Returns True if the file was written.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.write(fd, content)
+        os.fchmod(fd, mode)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+# SSID lines in `iw dev <interface> scan` output; hidden networks report an empty SSID
+_SSID_RE = re.compile(rb'(?m)^[ \t]*SSID:[ \t]*(.*)$')
+
 class AutoWiFiCapture:
     def __init__(self):
         self.config_file = Path("/etc/wifi_credentials.json")
         self.bluetooth_service_name = "PiWiFiSetup"
         self.wifi_ssid = "PiWiFiSetup"
         self.wifi_password = "12345678"  # Simple password for easy sharing
+        self.bluetooth_config = _BLUETOOTH_CONF_TEMPLATE.substitute(
+            name=self.bluetooth_service_name).encode()
+        self.hostapd_config = _HOSTAPD_CONF_TEMPLATE.substitute(
+            ssid=self.wifi_ssid, passphrase=self.wifi_password).encode()
         self.mainloop = None
         self.bus = None
         self.adapter = None
-        self.connected_devices = set()
+        # Interned object path -> (name, address, monotonic connect time)
+        self.connected_devices = {}
         self.credentials_captured = False
+        self.known_leases = set()
+        self.leases_monitor = None
+        self.network_attempt_pending = False
         
     def check_dependencies(self) -> bool:
         """Check if required system packages are installed."""
-        required_packages = ['bluez', 'bluez-tools', 'wpasupplicant', 'hostapd', 'dnsmasq', 'python3-dbus', 'python3-gi']
+        required_packages = ['bluez', 'bluez-tools', 'wpasupplicant', 'iw', 'hostapd', 'dnsmasq', 'python3-dbus', 'python3-gi']
         
-        missing_packages = []
-        for package in required_packages:
-            try:
-                subprocess.run(['dpkg', '-s', package], 
-                             capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                missing_packages.append(package)
+        # Query all packages with a single dpkg-query call. It exits non-zero
+        # when any package is unknown but still prints the others.
+        result = subprocess.run(['dpkg-query', '-W', '-f=${Package}\t${Status}\n',
+                               *required_packages],
+                              capture_output=True, text=True, check=False)
+        
+        installed_packages = set()
+        for line in result.stdout.splitlines():
+            package, _, status = line.partition('\t')
+            if status == 'install ok installed':
+                installed_packages.add(package)
+        
+        missing_packages = [package for package in required_packages
+                            if package not in installed_packages]
         
         if missing_packages:
-            logger.error(f"Missing packages: {', '.join(missing_packages)}")
+            logger.error("Missing packages: %s", ', '.join(missing_packages))
             logger.info("Install with: sudo apt update && sudo apt install " + 
                        " ".join(missing_packages))
             return False
@@ -68,141 +179,68 @@ class AutoWiFiCapture:
     def setup_bluetooth(self) -> bool:
         """Setup Bluetooth service for device detection."""
         try:
-            # Stop existing Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'stop', 'bluetooth'], 
-                         capture_output=True)
-            
-            # Configure Bluetooth
-            bluetooth_config = f"""
-[General]
-Name = {self.bluetooth_service_name}
-Class = 0x000100
-DiscoverableTimeout = 0
-PairableTimeout = 0
-AutoEnable = true
-
-[Policy]
-AutoEnable = true
-"""
-            
-            with open('/tmp/bluetooth.conf', 'w') as f:
-                f.write(bluetooth_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/bluetooth.conf', 
-                          '/etc/bluetooth/main.conf'], check=True)
-            
-            # Start Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'start', 'bluetooth'], 
-                         check=True)
-            subprocess.run(['sudo', 'systemctl', 'enable', 'bluetooth'], 
+            # Configure Bluetooth; bluetoothd only reads main.conf at startup,
+            # so restart it only when the config actually changed
+            if _atomic_write('/etc/bluetooth/main.conf', self.bluetooth_config):
+                subprocess.run(['systemctl', 'stop', 'bluetooth'], 
+                             capture_output=True)
+            
+            # Enable and start Bluetooth service
+            subprocess.run(['systemctl', 'enable', '--now', 'bluetooth'], 
                          check=True)
             
-            # Make Pi discoverable and pairable
-            subprocess.run(['sudo', 'bluetoothctl', 'discoverable', 'on'], 
-                         check=True)
-            subprocess.run(['sudo', 'bluetoothctl', 'pairable', 'on'], 
-                         check=True)
+            # Make Pi discoverable and pairable in one bluetoothctl session
+            subprocess.run(['bluetoothctl'], 
+                         input="discoverable on\npairable on\nquit\n", 
+                         text=True, check=True)
             
-            # Wait for Bluetooth to be ready
-            time.sleep(3)
+            # No settle delay: enable --now only returns once bluetoothd owns
+            # org.bluez, which the bluetoothctl session above relied on too. A
+            # controller that is still registering is waited for in setup_dbus,
+            # after the hotspot has been brought up.
             
             logger.info("Bluetooth service configured successfully")
             return True
             
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to setup Bluetooth: {e}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error("Failed to setup Bluetooth: %s", e)
             return False
     
     def setup_wifi_hotspot(self) -> bool:
         """Setup WiFi hotspot to capture credentials."""
         try:
             # Stop existing WiFi services
-            subprocess.run(['sudo', 'systemctl', 'stop', 'wpa_supplicant'], 
-                         capture_output=True)
-            subprocess.run(['sudo', 'systemctl', 'stop', 'networking'], 
+            subprocess.run(['systemctl', 'stop', 'wpa_supplicant', 'networking'], 
                          capture_output=True)
             
-            # Configure hostapd (WiFi access point)
-            hostapd_config = f"""
-interface=wlan0
-driver=nl80211
-ssid={self.wifi_ssid}
-hw_mode=g
-channel=7
-wmm_enabled=0
-macaddr_acl=0
-auth_algs=1
-ignore_broadcast_ssid=0
-wpa=2
-wpa_passphrase={self.wifi_password}
-wpa_key_mgmt=WPA-PSK
-wpa_pairwise=TKIP
-rsn_pairwise=CCMP
-"""
-            
-            with open('/tmp/hostapd.conf', 'w') as f:
-                f.write(hostapd_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/hostapd.conf', 
-                          '/etc/hostapd/hostapd.conf'], check=True)
+            # Configure hostapd (WiFi access point); the config holds the
+            # hotspot passphrase
+            config_changed = _atomic_write('/etc/hostapd/hostapd.conf', 
+                                           self.hostapd_config, mode=0o600)
             
             # Configure dnsmasq (DHCP server)
-            dnsmasq_config = """
-interface=wlan0
-dhcp-range=192.168.4.2,192.168.4.20,255.255.255.0,24h
-dhcp-option=3,192.168.4.1
-dhcp-option=6,192.168.4.1
-server=8.8.8.8
-server=8.8.4.4
-log-queries
-log-dhcp
-listen-address=192.168.4.1
-address=/#/192.168.4.1
-"""
-            
-            with open('/tmp/dnsmasq.conf', 'w') as f:
-                f.write(dnsmasq_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/dnsmasq.conf', 
-                          '/etc/dnsmasq.conf'], check=True)
+            config_changed |= _atomic_write('/etc/dnsmasq.conf', _DNSMASQ_CONF)
             
             # Configure network interface
-            network_config = """
-auto lo
-iface lo inet loopback
-
-auto wlan0
-iface wlan0 inet static
-    address 192.168.4.1
-    netmask 255.255.255.0
-    network 192.168.4.0
-    broadcast 192.168.4.255
-"""
-            
-            with open('/tmp/interfaces', 'w') as f:
-                f.write(network_config)
+            config_changed |= _atomic_write('/etc/network/interfaces', _INTERFACES_CONF)
             
-            subprocess.run(['sudo', 'cp', '/tmp/interfaces', 
-                          '/etc/network/interfaces'], check=True)
-            
-            # Start services
-            subprocess.run(['sudo', 'systemctl', 'start', 'networking'], 
-                         check=True)
-            subprocess.run(['sudo', 'systemctl', 'start', 'hostapd'], 
-                         check=True)
-            subprocess.run(['sudo', 'systemctl', 'start', 'dnsmasq'], 
+            # Start services, restarting them only if their config changed;
+            # systemd still orders hostapd and dnsmasq after networking since
+            # they are queued in the same transaction
+            action = 'restart' if config_changed else 'start'
+            subprocess.run(['systemctl', action, 'networking', 'hostapd', 'dnsmasq'], 
                          check=True)
             
-            # Wait for WiFi to be ready
-            time.sleep(5)
+            # hostapd and dnsmasq are forking services, so systemctl start
+            # returns once they are up and no settle delay is needed
             
             logger.info("WiFi hotspot configured successfully")
-            logger.info(f"SSID: {self.wifi_ssid}")
-            logger.info(f"Password: {self.wifi_password}")
+            logger.info("SSID: %s", self.wifi_ssid)
+            logger.info("Password: %s", self.wifi_password)
             return True
             
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to setup WiFi hotspot: {e}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error("Failed to setup WiFi hotspot: %s", e)
             return False
     
     def setup_dbus(self) -> bool:
@@ -212,17 +250,30 @@ iface wlan0 inet static
             self.bus = dbus.SystemBus()
             self.mainloop = GLib.MainLoop()
             
-            # Get Bluetooth adapter
-            manager = dbus.Interface(
-                self.bus.get_object("org.bluez", "/"),
-                "org.freedesktop.DBus.ObjectManager"
-            )
+            # Get Bluetooth adapter, trying the default hci0 before enumerating everything
+            try:
+                adapter_props = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/org/bluez/hci0", introspect=False),
+                    "org.freedesktop.DBus.Properties"
+                )
+                adapter_props.Get("org.bluez.Adapter1", "Address")
+                self.adapter = "/org/bluez/hci0"
+            except dbus.exceptions.DBusException:
+                manager = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/", introspect=False),
+                    "org.freedesktop.DBus.ObjectManager"
+                )
+                
+                objects = manager.GetManagedObjects()
+                for path, interfaces in objects.items():
+                    if "org.bluez.Adapter1" in interfaces:
+                        self.adapter = path
+                        break
             
-            objects = manager.GetManagedObjects()
-            for path, interfaces in objects.items():
-                if "org.bluez.Adapter1" in interfaces:
-                    self.adapter = path
-                    break
+            if not self.adapter:
+                # The controller may not have been registered yet when the
+                # bluetoothctl session ran
+                self.adapter = self.wait_for_adapter(5)
             
             if not self.adapter:
                 logger.error("No Bluetooth adapter found")
@@ -232,9 +283,46 @@ iface wlan0 inet static
             return True
             
         except Exception as e:
-            logger.error(f"Failed to setup D-Bus: {e}")
+            logger.error("Failed to setup D-Bus: %s", e)
             return False
     
+    def wait_for_adapter(self, timeout: int) -> Optional[str]:
+        """Return the object path of the first adapter BlueZ registers within timeout seconds."""
+        wait_loop = GLib.MainLoop()
+        adapter_state = {'path': None}
+        
+        def on_interfaces_added(path, interfaces):
+            if "org.bluez.Adapter1" in interfaces:
+                adapter_state['path'] = str(path)
+                wait_loop.quit()
+        
+        adapter_match = self.bus.add_signal_receiver(
+            on_interfaces_added,
+            signal_name="InterfacesAdded",
+            dbus_interface="org.freedesktop.DBus.ObjectManager",
+            bus_name="org.bluez",
+            path="/"
+        )
+        
+        try:
+            # Catch an adapter registered before we subscribed
+            manager = dbus.Interface(
+                self.bus.get_object("org.bluez", "/", introspect=False),
+                "org.freedesktop.DBus.ObjectManager"
+            )
+            for path, interfaces in manager.GetManagedObjects().items():
+                if "org.bluez.Adapter1" in interfaces:
+                    return str(path)
+            
+            logger.info("Waiting for a Bluetooth adapter...")
+            timeout_id = GLib.timeout_add_seconds(timeout, wait_loop.quit)
+            wait_loop.run()
+            if adapter_state['path']:
+                GLib.source_remove(timeout_id)
+            return adapter_state['path']
+        finally:
+            adapter_match.remove()
+    
     def setup_bluetooth_monitoring(self) -> bool:
         """Setup monitoring for Bluetooth connections."""
         try:
@@ -252,11 +340,26 @@ iface wlan0 inet static
                 dbus_interface="org.freedesktop.DBus.ObjectManager"
             )
             
+            # Monitor already known devices connecting and disconnecting
+            self.bus.add_signal_receiver(
+                self.on_device_properties_changed,
+                signal_name="PropertiesChanged",
+                dbus_interface="org.freedesktop.DBus.Properties",
+                arg0="org.bluez.Device1",
+                path_keyword="path"
+            )
+            
+            # Monitor dnsmasq's lease file for devices joining the hotspot
+            self.known_leases = self.read_lease_addresses()
+            self.leases_monitor = Gio.File.new_for_path(DNSMASQ_LEASES).monitor_file(
+                Gio.FileMonitorFlags.NONE, None)
+            self.leases_monitor.connect("changed", self.on_leases_changed)
+            
             logger.info("Bluetooth monitoring setup complete")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to setup Bluetooth monitoring: {e}")
+            logger.error("Failed to setup Bluetooth monitoring: %s", e)
             return False
     
     def on_device_connected(self, path, interfaces):
@@ -267,24 +370,74 @@ iface wlan0 inet static
                 device_name = device.get("Name", "Unknown Device")
                 device_address = device.get("Address", "Unknown")
                 
-                logger.info(f"Device connected: {device_name} ({device_address})")
-                self.connected_devices.add(path)
+                logger.info("Device connected: %s (%s)", device_name, device_address)
+                self.connected_devices[sys.intern(str(path))] = (
+                    device_name, device_address, time.monotonic())
                 
                 # Start monitoring for WiFi credentials
                 self.monitor_wifi_credentials()
                 
         except Exception as e:
-            logger.error(f"Error handling device connection: {e}")
+            logger.error("Error handling device connection: %s", e)
     
     def on_device_disconnected(self, path, interfaces):
         """Called when a device disconnects from Bluetooth."""
         try:
-            if path in self.connected_devices:
-                logger.info(f"Device disconnected: {path}")
-                self.connected_devices.remove(path)
+            device = self.connected_devices.pop(sys.intern(str(path)), None)
+            if device:
+                logger.info("Device disconnected: %s (%s)", device[0], device[1])
                 
         except Exception as e:
-            logger.error(f"Error handling device disconnection: {e}")
+            logger.error("Error handling device disconnection: %s", e)
+    
+    def on_device_properties_changed(self, interface, changed, invalidated, path=None):
+        """Called when a known Bluetooth device connects or disconnects."""
+        try:
+            if "Connected" not in changed:
+                return
+            
+            key = sys.intern(str(path))
+            if changed["Connected"]:
+                if key not in self.connected_devices:
+                    logger.info("Device connected: %s", key)
+                    self.connected_devices[key] = ("Unknown Device", "Unknown", time.monotonic())
+                    self.monitor_wifi_credentials()
+            else:
+                device = self.connected_devices.pop(key, None)
+                if device:
+                    logger.info("Device disconnected: %s (%s)", device[0], device[1])
+                
+        except Exception as e:
+            logger.error("Error handling device property change: %s", e)
+    
+    def read_lease_addresses(self) -> set:
+        """Return the hotspot addresses currently leased by dnsmasq."""
+        try:
+            with open(DNSMASQ_LEASES) as f:
+                # Each line is: expiry MAC IP hostname client-id
+                return {fields[2] for fields in map(str.split, f)
+                        if len(fields) > 2 and fields[2].startswith('192.168.4.')}
+        except FileNotFoundError:
+            return set()
+    
+    def on_leases_changed(self, monitor, file, other_file, event_type):
+        """Called when dnsmasq updates its DHCP lease file."""
+        try:
+            if event_type not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                                  Gio.FileMonitorEvent.CREATED):
+                return
+            
+            # dnsmasq rewrites the whole file, so compare against the last read
+            leases = self.read_lease_addresses()
+            new_leases = leases - self.known_leases
+            self.known_leases = leases
+            
+            if new_leases and self.connected_devices and not self.credentials_captured:
+                logger.info("New DHCP lease: %s", ', '.join(sorted(new_leases)))
+                self.on_hotspot_client()
+                
+        except Exception as e:
+            logger.error("Error handling DHCP lease change: %s", e)
     
     def monitor_wifi_credentials(self):
         """Monitor for WiFi credentials being shared."""
@@ -293,64 +446,77 @@ iface wlan0 inet static
             logger.info("Your phone should automatically share WiFi credentials!")
             logger.info("Check your phone for a 'Share WiFi' or 'Network sharing' prompt")
             
-            # Check for credentials every 5 seconds
-            while not self.credentials_captured and len(self.connected_devices) > 0:
-                if self.check_for_shared_credentials():
-                    break
-                time.sleep(5)
+            # Pick up devices already on the hotspot; later ones are reported
+            # by the lease file monitor
+            if not self.credentials_captured:
+                self.check_for_shared_credentials()
                 
         except Exception as e:
-            logger.error(f"Error monitoring credentials: {e}")
+            logger.error("Error monitoring credentials: %s", e)
     
     def check_for_shared_credentials(self) -> bool:
         """Check if WiFi credentials have been shared."""
         try:
-            # Check if any device has connected to our WiFi hotspot
-            result = subprocess.run(['arp', '-n'], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                # Look for devices connected to our hotspot
-                lines = result.stdout.split('\n')
-                for line in lines:
-                    if '192.168.4.' in line and 'wlan0' in line:
-                        # Device connected to our hotspot
-                        logger.info("Device connected to WiFi hotspot!")
-                        
-                        # Wait a bit for credentials to be shared
-                        time.sleep(10)
-                        
-                        # Check if we can now connect to the phone's network
-                        if self.attempt_network_connection():
-                            return True
+            # Check if any device has connected to our WiFi hotspot, reading
+            # the kernel's neighbour table directly instead of running arp
+            with open('/proc/net/arp', 'rb') as f:
+                data = f.read()
+            
+            # Columns: IP address, HW type, Flags, HW address, Mask, Device
+            for line in data.splitlines()[1:]:
+                fields = line.split()
+                # Skip malformed rows and incomplete entries (flags 0x0), which
+                # are left behind for clients that have already gone away
+                if len(fields) < 6 or fields[2] == b'0x0':
+                    continue
+                ip, dev = fields[0], fields[5]
+                if dev == b'wlan0' and ip.startswith(b'192.168.4.'):
+                    # Device connected to our hotspot
+                    self.on_hotspot_client()
+                    return True
             
             return False
             
         except Exception as e:
-            logger.error(f"Error checking for shared credentials: {e}")
+            logger.error("Error checking for shared credentials: %s", e)
             return False
     
+    def on_hotspot_client(self):
+        """Handle a device joining the WiFi hotspot."""
+        logger.info("Device connected to WiFi hotspot!")
+        if self.network_attempt_pending:
+            return
+        
+        # Wait a bit for credentials to be shared, without blocking the main loop
+        self.network_attempt_pending = True
+        GLib.timeout_add_seconds(10, self.run_network_attempt)
+    
+    def run_network_attempt(self) -> bool:
+        """Timeout callback for on_hotspot_client."""
+        self.network_attempt_pending = False
+        
+        # Check if we can now connect to the phone's network
+        if not self.credentials_captured:
+            self.attempt_network_connection()
+        return False
+    
     def attempt_network_connection(self) -> bool:
         """Attempt to connect to the phone's WiFi network."""
         try:
             logger.info("Attempting to connect to phone's WiFi network...")
             
             # Stop hotspot services
-            subprocess.run(['sudo', 'systemctl', 'stop', 'hostapd'], 
-                         capture_output=True)
-            subprocess.run(['sudo', 'systemctl', 'stop', 'dnsmasq'], 
-                         capture_output=True)
-            
-            # Try to scan for available networks
-            subprocess.run(['sudo', 'iwlist', 'wlan0', 'scan'], 
+            subprocess.run(['systemctl', 'stop', 'hostapd', 'dnsmasq'], 
                          capture_output=True)
             
-            # Check if we can see the phone's network
-            result = subprocess.run(['iwlist', 'wlan0', 'scan'], 
-                                  capture_output=True, text=True)
+            # Scan for available networks to check if we can see the phone's network
+            result = subprocess.run(['iw', 'dev', 'wlan0', 'scan'], 
+                                  capture_output=True, check=False)
             
             if result.returncode == 0:
-                logger.info("Available WiFi networks:")
-                logger.info(result.stdout)
+                ssids = [ssid for ssid in _SSID_RE.findall(result.stdout) if ssid]
+                logger.info("Available WiFi networks: %s",
+                            b", ".join(ssids).decode(errors='replace'))
                 
                 # For now, we'll need to manually input the credentials
                 # In a real implementation, you'd parse the shared credentials
@@ -363,7 +529,7 @@ iface wlan0 inet static
             return False
             
         except Exception as e:
-            logger.error(f"Error attempting network connection: {e}")
+            logger.error("Error attempting network connection: %s", e)
             return False
     
     def run(self):
@@ -405,8 +571,8 @@ iface wlan0 inet static
             logger.info("4. Pi will automatically capture the credentials!")
             logger.info("")
             logger.info("WiFi Hotspot Details:")
-            logger.info(f"  SSID: {self.wifi_ssid}")
-            logger.info(f"  Password: {self.wifi_password}")
+            logger.info("  SSID: %s", self.wifi_ssid)
+            logger.info("  Password: %s", self.wifi_password)
             logger.info("  IP: 192.168.4.1")
             
             # Start the main loop to monitor for connections
@@ -416,7 +582,7 @@ iface wlan0 inet static
             logger.info("Shutting down...")
             return True
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             return False
 
 def main():
@@ -12,28 +12,141 @@ Usage:
 """
 
 import os
+import re
 import sys
 import time
 import json
+import select
+import socket
+import threading
+import tempfile
 import subprocess
 import logging
+import logging.handlers
 import dbus
 import dbus.mainloop.glib
 from pathlib import Path
 from typing import Optional, Dict, Any
 from gi.repository import GLib
 
-# Configure logging
+# Configure logging; rotate the log so it cannot grow without bound on the SD card
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('/var/log/wifi_direct_sharer.log'),
+        logging.handlers.RotatingFileHandler('/var/log/wifi_direct_sharer.log',
+                                             maxBytes=1 << 20, backupCount=3),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# wpa_supplicant control interface directory (matches ctrl_interface in our configs)
+WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+
+# Any hint of network information in wpa_supplicant or Bluetooth device output
+_NET_HINT = re.compile(r'network|ssid|wifi', re.I)
+
+# The only two fields of wpa_supplicant STATUS output we need
+_KV_RE = re.compile(r'^(ssid|psk)=(.*?)[ \t\r]*$', re.M)
+
+# STATUS fields reported while we are group owner or client of a P2P group
+_P2P_ACTIVE = re.compile(r'p2p_(?:go|client)_mode=1')
+
+def _atomic_write(path: str, content: bytes, mode: int = 0o644):
+    """Atomically replace path with content via a temp file in the same directory."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.write(fd, content)
+        os.fchmod(fd, mode)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+class WpaCtrl:
+    """Minimal client for the wpa_supplicant control interface socket."""
+
+    _instances = 0
+
+    def __init__(self, interface: str = "wlan0"):
+        WpaCtrl._instances += 1
+        self.local_path = f"/tmp/wpa_ctrl_{os.getpid()}-{WpaCtrl._instances}"
+        self.attached = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local_path):
+                os.unlink(self.local_path)
+            self.sock.bind(self.local_path)
+            self.sock.connect(os.path.join(WPA_CTRL_DIR, interface))
+        except OSError:
+            self.close()
+            raise
+
+    def request(self, command: str, timeout: float = 10.0) -> str:
+        """Send a command and return its reply, skipping unsolicited events."""
+        return self.request_many([command], timeout)[0]
+
+    def request_many(self, commands: list, timeout: float = 10.0) -> list:
+        """Send commands back to back, then read their replies in order."""
+        if not self.attached:
+            # Discard a late reply to an earlier request that timed out
+            self.sock.setblocking(False)
+            try:
+                while self.sock.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+        self.sock.settimeout(timeout)
+        for command in commands:
+            self.sock.send(command.encode())
+        replies = []
+        while len(replies) < len(commands):
+            reply = self.sock.recv(4096).decode(errors='replace')
+            if not (self.attached and reply.startswith('<')):
+                replies.append(reply)
+        return replies
+
+    def attach(self) -> bool:
+        """Register this socket for unsolicited event messages."""
+        self.attached = self.request('ATTACH').startswith('OK')
+        return self.attached
+
+    def wait_for_event(self, prefixes: tuple, timeout: float) -> Optional[str]:
+        """Block until an event starting with one of prefixes arrives."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return None
+
+            event = self.sock.recv(4096).decode(errors='replace')
+            # Strip the "<level>" priority prefix
+            if event.startswith('<'):
+                event = event.split('>', 1)[-1]
+            if event.startswith(prefixes):
+                return event
+
+    def close(self):
+        """Detach and remove the local socket."""
+        try:
+            if self.attached:
+                self.request('DETACH', timeout=1.0)
+        except OSError:
+            pass
+        self.attached = False
+        self.sock.close()
+        if os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+
 class WiFiDirectSharer:
     def __init__(self):
         self.config_file = Path("/etc/wifi_credentials.json")
@@ -41,21 +154,34 @@ class WiFiDirectSharer:
         self.mainloop = None
         self.bus = None
         self.adapter = None
+        self.managed_objects = None  # object path -> interfaces, fetched on first use and kept in sync from signals
         self.connected_devices = set()
+        self.extraction_lock = threading.Lock()
         self.credentials_received = False
+        self.last_credentials = None  # last credentials written to config_file
         self.wifi_direct_interface = "p2p0"  # WiFi Direct interface
+        self.wpa = None
+        self.wpa_events = None
+        self.svc_disc_sent = set()  # P2P addresses with a service discovery request pending, extraction worker only
         
     def check_dependencies(self) -> bool:
         """Check if required system packages are installed."""
         required_packages = ['bluez', 'bluez-tools', 'wpasupplicant', 'python3-dbus', 'python3-gi']
         
-        missing_packages = []
-        for package in required_packages:
-            try:
-                subprocess.run(['dpkg', '-s', package], 
-                             capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                missing_packages.append(package)
+        # Query all packages with a single dpkg-query call. It exits non-zero
+        # when any package is unknown but still prints the others.
+        result = subprocess.run(['dpkg-query', '-W', '-f=${Package}\t${Status}\n',
+                               *required_packages],
+                              capture_output=True, text=True, check=False)
+        
+        installed_packages = set()
+        for line in result.stdout.splitlines():
+            package, _, status = line.partition('\t')
+            if status == 'install ok installed':
+                installed_packages.add(package)
+        
+        missing_packages = [package for package in required_packages
+                            if package not in installed_packages]
         
         if missing_packages:
             logger.error(f"Missing packages: {', '.join(missing_packages)}")
@@ -65,14 +191,87 @@ class WiFiDirectSharer:
         
         return True
     
+    def wpa_request(self, command: str, timeout: float = 1.0) -> str:
+        """Send a command to wpa_supplicant over the persistent control socket."""
+        return self.wpa_request_many([command], timeout)[0]
+    
+    def wpa_request_many(self, commands: list, timeout: float = 1.0) -> list:
+        """Pipeline several commands over the control socket in one round trip."""
+        if self.wpa is None:
+            self.wpa = WpaCtrl()
+        try:
+            return self.wpa.request_many(commands, timeout)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # wpa_supplicant was restarted behind our back - reconnect once
+            self.close_wpa()
+            self.wpa = WpaCtrl()
+            return self.wpa.request_many(commands, timeout)
+    
+    def wpa_ok(self, reply: str) -> bool:
+        """Return True if a wpa_supplicant reply does not report an error."""
+        return not reply.startswith(('FAIL', 'UNKNOWN COMMAND'))
+    
+    def close_wpa(self):
+        """Close the control socket, e.g. before wpa_supplicant is restarted."""
+        if self.wpa:
+            self.wpa.close()
+            self.wpa = None
+    
+    def request_service_discovery(self, device_address: str) -> bool:
+        """Send a network information request to a peer unless one is already pending."""
+        if device_address in self.svc_disc_sent:
+            return True
+        if not self.wpa_ok(self.wpa_request(f'P2P_SERV_DISC_REQ {device_address} 02000001')):
+            return False
+        self.svc_disc_sent.add(device_address)
+        return True
+    
+    def wait_for_wpa(self, interface: str = "wlan0", timeout: float = 10.0) -> bool:
+        """Wait until a freshly started wpa_supplicant answers on its control socket."""
+        ctrl_path = os.path.join(WPA_CTRL_DIR, interface)
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        
+        # The socket usually appears within a few hundred milliseconds
+        while not os.path.exists(ctrl_path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"wpa_supplicant control socket {ctrl_path} did not appear")
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.8)
+        
+        try:
+            return self.wpa_request('PING').strip() == 'PONG'
+        except OSError as e:
+            logger.warning(f"wpa_supplicant did not answer PING: {e}")
+            return False
+    
+    def get_p2p_peers(self, first_reply: Optional[str] = None) -> str:
+        """Return the P2P_PEER details of every known peer, like wpa_cli p2p_peers."""
+        peers = []
+        reply = first_reply if first_reply is not None else self.wpa_request('P2P_PEER FIRST')
+        while self.wpa_ok(reply) and reply.strip():
+            peers.append(reply)
+            address = reply.split('\n', 1)[0]
+            reply = self.wpa_request(f'P2P_PEER NEXT-{address}')
+        return ''.join(peers)
+    
     def setup_bluetooth(self) -> bool:
         """Setup Bluetooth service for device detection."""
+        started = []
         try:
-            # Stop existing Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'stop', 'bluetooth'], 
-                         capture_output=True)
-            
-            # Configure Bluetooth
+            # Enabling the unit does not depend on the restart, so run it
+            # alongside stopping the existing Bluetooth service
+            enable = subprocess.Popen(['systemctl', 'enable', 'bluetooth'], 
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            started.append(enable)
+            stop = subprocess.Popen(['systemctl', 'stop', 'bluetooth'], 
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            started.append(stop)
+            
+            # Configure Bluetooth while the service stops; bluetoothd only
+            # reads main.conf at startup
             bluetooth_config = f"""
 [General]
 Name = {self.bluetooth_service_name}
@@ -85,42 +284,60 @@ AutoEnable = true
 AutoEnable = true
 """
             
-            with open('/tmp/bluetooth.conf', 'w') as f:
-                f.write(bluetooth_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/bluetooth.conf', 
-                          '/etc/bluetooth/main.conf'], check=True)
+            _atomic_write('/etc/bluetooth/main.conf', bluetooth_config.encode())
+            stop.wait()
             
             # Start Bluetooth service
-            subprocess.run(['sudo', 'systemctl', 'start', 'bluetooth'], 
-                         check=True)
-            subprocess.run(['sudo', 'systemctl', 'enable', 'bluetooth'], 
+            subprocess.run(['systemctl', 'start', 'bluetooth'], 
                          check=True)
             
-            # Make Pi discoverable and pairable
-            subprocess.run(['sudo', 'bluetoothctl', 'discoverable', 'on'], 
-                         check=True)
-            subprocess.run(['sudo', 'bluetoothctl', 'pairable', 'on'], 
-                         check=True)
+            # Power on and make Pi discoverable and pairable in one bluetoothctl session
+            btctl = subprocess.Popen(['bluetoothctl'], stdin=subprocess.PIPE, 
+                                   stdout=subprocess.DEVNULL, text=True)
+            started.append(btctl)
+            btctl.communicate("power on\ndiscoverable on\npairable on\nquit\n")
+            for proc in (enable, btctl):
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, proc.args)
             
-            # Wait for Bluetooth to be ready
-            time.sleep(3)
+            # Wait for the controller to come up instead of a fixed delay
+            self.wait_for_bluetooth_powered(5)
             
             logger.info("Bluetooth service configured successfully")
             return True
             
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.error(f"Failed to setup Bluetooth: {e}")
             return False
+        finally:
+            # Reap the background processes even if a later step failed
+            for proc in started:
+                proc.wait()
+    
+    def wait_for_bluetooth_powered(self, timeout: float) -> bool:
+        """Poll bluetoothctl show until the controller reports Powered: yes."""
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        
+        while True:
+            result = subprocess.run(['bluetoothctl', 'show'], capture_output=True, text=True)
+            if 'Powered: yes' in result.stdout:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("Bluetooth controller did not power on within %s seconds", timeout)
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.8)
     
     def setup_wifi_direct(self) -> bool:
         """Setup WiFi Direct for credential extraction."""
+        stops = []
         try:
-            # Stop existing WiFi services
-            subprocess.run(['sudo', 'systemctl', 'stop', 'wpa_supplicant'], 
-                         capture_output=True)
-            subprocess.run(['sudo', 'systemctl', 'stop', 'networking'], 
-                         capture_output=True)
+            # Stop existing WiFi services concurrently
+            for service in ('wpa_supplicant', 'networking'):
+                stops.append(subprocess.Popen(['systemctl', 'stop', service], 
+                                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
             
             # Create simplified wpa_supplicant configuration for WiFi Direct
             # Using only basic P2P parameters that are widely supported
@@ -147,31 +364,35 @@ p2p_passphrase_len=8
 p2p_pref_chan=81:1,81:6,81:11
 """
             
-            with open('/tmp/wpa_supplicant.conf', 'w') as f:
-                f.write(wpa_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
+            _atomic_write('/etc/wpa_supplicant/wpa_supplicant.conf', wpa_config.encode())
+            for stop in stops:
+                stop.wait()
             
             # Start wpa_supplicant with WiFi Direct support
-            subprocess.run(['sudo', 'wpa_supplicant', '-B', '-i', 'wlan0', 
+            self.close_wpa()
+            subprocess.run(['wpa_supplicant', '-B', '-i', 'wlan0', 
                           '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
                           '-D', 'nl80211'], check=True)
             
-            # Wait for WiFi Direct to be ready
-            time.sleep(5)
-            
-            # Test if WiFi Direct is working
+            # Test if WiFi Direct is working once wpa_supplicant is ready
             try:
-                subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], check=True, timeout=10)
+                p2p_ok = (self.wait_for_wpa() and
+                          self.wpa_ok(self.wpa_request('P2P_FIND', timeout=10)))
+            except OSError:
+                p2p_ok = False
+            
+            if p2p_ok:
                 logger.info("WiFi Direct configured successfully")
                 return True
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            else:
                 logger.warning("WiFi Direct setup failed, using fallback method")
                 return self.setup_wifi_direct_fallback()
             
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.error(f"Failed to setup WiFi Direct: {e}")
+            # Let the service stops finish before the fallback starts wpa_supplicant
+            for stop in stops:
+                stop.wait()
             logger.info("Trying fallback method...")
             return self.setup_wifi_direct_fallback()
     
@@ -190,26 +411,25 @@ update_config=1
 p2p_disabled=0
 """
             
-            with open('/tmp/wpa_supplicant.conf', 'w') as f:
-                f.write(wpa_config)
-            
-            subprocess.run(['sudo', 'cp', '/tmp/wpa_supplicant.conf', 
-                          '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
+            _atomic_write('/etc/wpa_supplicant/wpa_supplicant.conf', wpa_config.encode())
             
             # Start wpa_supplicant with minimal config
-            subprocess.run(['sudo', 'wpa_supplicant', '-B', '-i', 'wlan0', 
+            self.close_wpa()
+            subprocess.run(['wpa_supplicant', '-B', '-i', 'wlan0', 
                           '-c', '/etc/wpa_supplicant/wpa_supplicant.conf', 
                           '-D', 'nl80211'], check=True)
             
-            # Wait for wpa_supplicant to be ready
-            time.sleep(5)
-            
-            # Try basic P2P commands
+            # Try basic P2P commands once wpa_supplicant is ready
             try:
-                subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], check=True, timeout=5)
+                p2p_ok = (self.wait_for_wpa() and
+                          self.wpa_ok(self.wpa_request('P2P_FIND', timeout=5)))
+            except OSError:
+                p2p_ok = False
+            
+            if p2p_ok:
                 logger.info("WiFi Direct fallback configured successfully")
                 return True
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            else:
                 logger.warning("WiFi Direct fallback also failed, will use Bluetooth-only mode")
                 return True  # Return True to continue with Bluetooth monitoring
                 
@@ -225,17 +445,19 @@ p2p_disabled=0
             self.bus = dbus.SystemBus()
             self.mainloop = GLib.MainLoop()
             
-            # Get Bluetooth adapter
-            manager = dbus.Interface(
-                self.bus.get_object("org.bluez", "/"),
-                "org.freedesktop.DBus.ObjectManager"
-            )
-            
-            objects = manager.GetManagedObjects()
-            for path, interfaces in objects.items():
-                if "org.bluez.Adapter1" in interfaces:
-                    self.adapter = path
-                    break
+            # Get Bluetooth adapter, trying the default hci0 before enumerating everything
+            try:
+                adapter_props = dbus.Interface(
+                    self.bus.get_object("org.bluez", "/org/bluez/hci0", introspect=False),
+                    "org.freedesktop.DBus.Properties"
+                )
+                adapter_props.GetAll("org.bluez.Adapter1")
+                self.adapter = "/org/bluez/hci0"
+            except dbus.exceptions.DBusException:
+                for path, interfaces in self.get_managed_objects().items():
+                    if "org.bluez.Adapter1" in interfaces:
+                        self.adapter = path
+                        break
             
             if not self.adapter:
                 logger.error("No Bluetooth adapter found")
@@ -248,6 +470,17 @@ p2p_disabled=0
             logger.error(f"Failed to setup D-Bus: {e}")
             return False
     
+    def get_managed_objects(self) -> dict:
+        """Return the mirrored BlueZ object tree, fetching it on first use."""
+        if self.managed_objects is None:
+            manager = dbus.Interface(
+                self.bus.get_object("org.bluez", "/"),
+                "org.freedesktop.DBus.ObjectManager"
+            )
+            # InterfacesAdded/Removed and PropertiesChanged keep it current from here on
+            self.managed_objects = dict(manager.GetManagedObjects())
+        return self.managed_objects
+    
     def setup_bluetooth_monitoring(self) -> bool:
         """Setup monitoring for Bluetooth connections."""
         try:
@@ -265,6 +498,16 @@ p2p_disabled=0
                 dbus_interface="org.freedesktop.DBus.ObjectManager"
             )
             
+            # Monitor already paired devices reconnecting, which only
+            # toggles their Connected property
+            self.bus.add_signal_receiver(
+                self.on_device_properties_changed,
+                signal_name="PropertiesChanged",
+                dbus_interface="org.freedesktop.DBus.Properties",
+                arg0="org.bluez.Device1",
+                path_keyword="path"
+            )
+            
             logger.info("Bluetooth monitoring setup complete")
             return True
             
@@ -275,6 +518,9 @@ p2p_disabled=0
     def on_device_connected(self, path, interfaces):
         """Called when a device connects via Bluetooth."""
         try:
+            if self.managed_objects is not None:
+                self.managed_objects.setdefault(path, {}).update(interfaces)
+            
             if "org.bluez.Device1" in interfaces:
                 device = interfaces["org.bluez.Device1"]
                 device_name = device.get("Name", "Unknown Device")
@@ -284,7 +530,7 @@ p2p_disabled=0
                 self.connected_devices.add(path)
                 
                 # Start WiFi Direct credential extraction
-                self.extract_wifi_credentials_via_wifi_direct(device_name, device_address)
+                self.start_extraction(path, device_name, device_address)
                 
         except Exception as e:
             logger.error(f"Error handling device connection: {e}")
@@ -292,6 +538,14 @@ p2p_disabled=0
     def on_device_disconnected(self, path, interfaces):
         """Called when a device disconnects from Bluetooth."""
         try:
+            # interfaces lists the interface names that were removed
+            object_interfaces = self.managed_objects.get(path) if self.managed_objects is not None else None
+            if object_interfaces is not None:
+                for interface in interfaces:
+                    object_interfaces.pop(interface, None)
+                if not object_interfaces:
+                    del self.managed_objects[path]
+            
             if path in self.connected_devices:
                 logger.info(f"Device disconnected: {path}")
                 self.connected_devices.remove(path)
@@ -299,8 +553,56 @@ p2p_disabled=0
         except Exception as e:
             logger.error(f"Error handling device disconnection: {e}")
     
+    def on_device_properties_changed(self, interface, changed, invalidated, path=None):
+        """Called when a known Bluetooth device connects or disconnects."""
+        try:
+            # Keep the mirrored object tree current
+            device = None
+            if self.managed_objects is not None:
+                device = self.managed_objects.setdefault(path, {}).setdefault("org.bluez.Device1", {})
+                device.update(changed)
+            
+            if "Connected" not in changed:
+                return
+            
+            if changed["Connected"]:
+                if path not in self.connected_devices:
+                    if device is None or "Address" not in device:
+                        # Not mirrored yet, so read just this device's properties
+                        device = self.device_props(path)
+                    device_name = device.get("Name", "Unknown Device")
+                    device_address = device.get("Address", "Unknown")
+                    
+                    logger.info(f"Device connected: {device_name} ({device_address})")
+                    self.connected_devices.add(path)
+                    
+                    # Start WiFi Direct credential extraction
+                    self.start_extraction(path, device_name, device_address)
+            elif path in self.connected_devices:
+                logger.info(f"Device disconnected: {path}")
+                self.connected_devices.remove(path)
+                
+        except Exception as e:
+            logger.error(f"Error handling device property change: {e}")
+    
+    def start_extraction(self, path: str, device_name: str, device_address: str):
+        """Hand extraction to a worker thread so the main loop keeps dispatching signals."""
+        threading.Thread(target=self.extract_device, args=(path, device_name, device_address),
+                         daemon=True).start()
+    
+    def extract_device(self, path: str, device_name: str, device_address: str):
+        """Run credential extraction for one device, one device at a time."""
+        with self.extraction_lock:
+            if path not in self.connected_devices:
+                logger.info(f"Skipping {device_name} ({device_address}): no longer connected")
+                return
+            # Each extraction starts with no service discovery requests
+            # pending; the set is only touched under extraction_lock
+            self.svc_disc_sent.clear()
+            self.extract_wifi_credentials_via_wifi_direct(device_name, device_address)
+    
     def extract_wifi_credentials_via_wifi_direct(self, device_name: str, device_address: str) -> bool:
-        """Extract WiFi credentials using WiFi Direct protocol."""
+        """Extract WiFi credentials, trying each strategy in turn after a single discovery."""
         start_time = time.time()
         timeout_seconds = 120  # 2 minutes total timeout
         
@@ -308,79 +610,107 @@ p2p_disabled=0
             logger.info(f"Starting WiFi Direct credential extraction from {device_name}...")
             logger.info(f"Total timeout: {timeout_seconds} seconds")
             
-            # Step 1: Discover WiFi Direct devices
+            # Step 1: Discover WiFi Direct devices once for all strategies
             logger.info("Step 1: Discovering WiFi Direct devices...")
-            try:
-                subprocess.run(['sudo', 'wpa_cli', 'p2p_find'], check=True, timeout=10)
-                logger.info("WiFi Direct discovery started, waiting 10 seconds...")
-                time.sleep(10)  # Wait for discovery
-                
-                # Check timeout
-                if time.time() - start_time > timeout_seconds:
-                    logger.warning("Timeout reached during discovery")
-                    return False
-                    
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-                logger.warning("WiFi Direct discovery failed, trying Bluetooth-only method")
-                return self.extract_wifi_credentials_via_bluetooth_only(device_name, device_address)
+            discovered_devices = self.discover_wifi_direct_devices()
             
-            # Step 2: Get list of discovered devices
-            logger.info("Step 2: Getting list of discovered devices...")
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                  capture_output=True, text=True, check=True)
-            
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("WiFi Direct devices discovered:")
-                logger.info(result.stdout)
-                
-                # Parse discovered devices
-                discovered_devices = self.parse_discovered_devices(result.stdout)
-                logger.info(f"Found {len(discovered_devices)} WiFi Direct devices")
-                
-                # Step 3: Try to connect to each discovered device
-                for i, device_info in enumerate(discovered_devices):
-                    logger.info(f"Step 3: Attempting connection to {device_info['name']} ({device_info['address']})... ({i+1}/{len(discovered_devices)})")
-                    
-                    # Check timeout before each connection attempt
-                    if time.time() - start_time > timeout_seconds:
-                        logger.warning("Timeout reached during connection attempts")
-                        return False
-                    
-                    if self.connect_via_wifi_direct(device_info['name'], device_info['address']):
-                        logger.info("WiFi Direct connection successful!")
-                        return True
-                    else:
-                        logger.info(f"Connection to {device_info['name']} failed, trying next device...")
-                        
-                        # Debug current state after failed connection
-                        logger.info("Debugging current state after failed connection...")
-                        self.debug_wifi_direct_state()
+            strategies = [
+                ("Bluetooth-only extraction",
+                 lambda: self.extract_wifi_credentials_via_bluetooth_only(device_name, device_address))
+            ]
+            if discovered_devices is not None:
+                deadline = start_time + timeout_seconds
+                strategies[:0] = [
+                    ("Connecting to discovered WiFi Direct devices",
+                     lambda: self.connect_to_discovered_devices(discovered_devices, deadline)),
+                    ("Requesting network information via service discovery",
+                     lambda: self.try_service_discovery(device_address)),
+                    ("Direct credential extraction",
+                     lambda: self.direct_wifi_direct_extraction(device_name, device_address)),
+                ]
             else:
-                logger.info("No WiFi Direct devices discovered")
+                logger.warning("WiFi Direct discovery failed, only trying Bluetooth-only method")
             
-            # Step 4: Try alternative WiFi Direct methods
-            logger.info("Step 4: Trying alternative WiFi Direct methods...")
-            if time.time() - start_time > timeout_seconds:
-                logger.warning("Timeout reached before alternative methods")
-                return False
+            # Steps 2+: stop at the first strategy that yields credentials
+            for step, (description, strategy) in enumerate(strategies, 2):
+                if time.time() - start_time > timeout_seconds:
+                    logger.warning(f"Timeout reached before step {step}")
+                    return False
                 
-            if self.try_alternative_wifi_direct_methods(device_name, device_address):
-                return True
+                logger.info(f"Step {step}: {description}...")
+                if strategy():
+                    return True
             
-            # Step 5: Fallback to Bluetooth-only method
-            logger.info("Step 5: WiFi Direct methods failed, trying Bluetooth-only extraction...")
-            return self.extract_wifi_credentials_via_bluetooth_only(device_name, device_address)
+            return False
             
         except Exception as e:
             logger.error(f"Error in WiFi Direct credential extraction: {e}")
-            logger.info("Falling back to Bluetooth-only method...")
-            return self.extract_wifi_credentials_via_bluetooth_only(device_name, device_address)
+            return False
         finally:
+            if self.wpa_events:
+                self.wpa_events.close()
+                self.wpa_events = None
             elapsed_time = time.time() - start_time
             logger.info(f"WiFi Direct extraction completed in {elapsed_time:.1f} seconds")
     
+    def discover_wifi_direct_devices(self) -> Optional[list]:
+        """Run P2P discovery and return the peers found, or None if WiFi Direct is unusable."""
+        try:
+            # Listen for wpa_supplicant events before starting discovery so
+            # no P2P-DEVICE-FOUND or group events are missed
+            self.wpa_events = WpaCtrl()
+            if not self.wpa_events.attach():
+                raise OSError("ATTACH was rejected")
+            
+            if not self.wpa_ok(self.wpa_request('P2P_FIND', timeout=10)):
+                raise OSError("P2P_FIND was rejected")
+            logger.info("WiFi Direct discovery started, waiting up to 10 seconds...")
+            if not self.wpa_events.wait_for_event(('P2P-DEVICE-FOUND',), 10):
+                logger.info("No P2P-DEVICE-FOUND event within 10 seconds")
+            
+            # Get list of discovered devices
+            peers = self.get_p2p_peers()
+            
+        except OSError as e:
+            logger.warning(f"WiFi Direct discovery failed: {e}")
+            return None
+        
+        if not peers.strip():
+            logger.info("No WiFi Direct devices discovered")
+            return []
+        
+        logger.info("WiFi Direct devices discovered")
+        logger.debug("P2P peers:\n%s", peers)
+        
+        # Parse discovered devices
+        discovered_devices = self.parse_discovered_devices(peers)
+        logger.info(f"Found {len(discovered_devices)} WiFi Direct devices")
+        return discovered_devices
+    
+    def connect_to_discovered_devices(self, discovered_devices: list, deadline: float) -> bool:
+        """Try to connect to each discovered device until one yields credentials."""
+        for i, device_info in enumerate(discovered_devices):
+            logger.info(f"Attempting connection to {device_info['name']} ({device_info['address']})... ({i+1}/{len(discovered_devices)})")
+            
+            # Check timeout before each connection attempt
+            if time.time() > deadline:
+                logger.warning("Timeout reached during connection attempts")
+                return False
+            
+            if self.connect_via_wifi_direct(device_info['name'], device_info['address']):
+                logger.info("WiFi Direct connection successful!")
+                return True
+            else:
+                logger.info(f"Connection to {device_info['name']} failed, trying next device...")
+                
+                # Debug current state after failed connection
+                logger.debug("Debugging current state after failed connection...")
+                self.debug_wifi_direct_state()
+        
+        return False
+    
     def parse_discovered_devices(self, peers_output: str) -> list:
-        """Parse the output of p2p_peers to extract device information."""
+        """Parse P2P_PEER details to extract device information."""
         devices = []
         try:
             lines = peers_output.strip().split('\n')
@@ -388,14 +718,15 @@ p2p_disabled=0
             
             for line in lines:
                 line = line.strip()
-                if line.startswith('dev_addr='):
+                if '=' not in line and line.count(':') == 5:
+                    # Each P2P_PEER reply starts with the peer's device address
                     if current_device:
                         devices.append(current_device)
-                    current_device = {'address': line.split('=', 1)[1]}
-                elif line.startswith('dev_name='):
+                    current_device = {'address': line, 'name': 'Unknown'}
+                elif line.startswith('device_name='):
                     current_device['name'] = line.split('=', 1)[1]
-                elif line.startswith('p2p_dev_addr='):
-                    current_device['p2p_address'] = line.split('=', 1)[1]
+                elif line.startswith('interface_addr='):
+                    current_device['interface_address'] = line.split('=', 1)[1]
             
             # Add the last device
             if current_device:
@@ -410,6 +741,22 @@ p2p_disabled=0
         
         return devices
     
+    def find_device_path(self, device_address: str) -> Optional[str]:
+        """Return the object path of the known BlueZ device with device_address."""
+        # Copy the items, the main loop may update the mirror meanwhile
+        for path, interfaces in list(self.get_managed_objects().items()):
+            device = interfaces.get("org.bluez.Device1")
+            if device and device.get("Address") == device_address:
+                return path
+        return None
+    
+    def device_props(self, path: str) -> dict:
+        """Read all org.bluez.Device1 properties of the device at path."""
+        return dbus.Interface(
+            self.bus.get_object("org.bluez", path),
+            "org.freedesktop.DBus.Properties"
+        ).GetAll("org.bluez.Device1")
+    
     def extract_wifi_credentials_via_bluetooth_only(self, device_name: str, device_address: str) -> bool:
         """Extract WiFi credentials using Bluetooth-only methods."""
         try:
@@ -420,20 +767,26 @@ p2p_disabled=0
             
             # Try to get device capabilities
             try:
-                # Use bluetoothctl to get device info
-                result = subprocess.run(['sudo', 'bluetoothctl', 'info', device_address], 
-                                      capture_output=True, text=True, check=True)
+                device_path = self.find_device_path(device_address) if self.bus else None
+                if device_path:
+                    # Read the device properties straight from BlueZ
+                    properties = self.device_props(device_path)
+                    device_info = "\n".join(f"{key}: {value}" for key, value in properties.items())
+                else:
+                    # Use bluetoothctl to get device info
+                    result = subprocess.run(['bluetoothctl', 'info', device_address], 
+                                          capture_output=True, text=True, check=True)
+                    device_info = result.stdout
                 
-                if result.returncode == 0:
-                    logger.info("Device information retrieved:")
-                    logger.info(result.stdout)
-                    
-                    # Look for network-related information
-                    if self.parse_bluetooth_device_info(result.stdout):
-                        return True
+                logger.info("Device information retrieved")
+                logger.debug("Device information:\n%s", device_info)
+                
+                # Look for network-related information
+                if self.parse_bluetooth_device_info(device_info):
+                    return True
                         
-            except subprocess.CalledProcessError:
-                logger.info("Could not get device info via bluetoothctl")
+            except (subprocess.CalledProcessError, dbus.exceptions.DBusException):
+                logger.info("Could not get device info")
             
             # Method 2: Try to request network sharing via Bluetooth
             logger.info("Method 2: Requesting network sharing via Bluetooth...")
@@ -441,7 +794,6 @@ p2p_disabled=0
             # This is a simplified approach - in practice, you'd implement
             # the actual Bluetooth protocol for network sharing
             logger.info("Network sharing request sent via Bluetooth")
-            time.sleep(5)
             
             # Method 3: Simulate credential extraction (for testing)
             logger.info("Method 3: Simulating credential extraction...")
@@ -449,7 +801,6 @@ p2p_disabled=0
             # For testing purposes, simulate finding credentials
             # In a real implementation, you'd implement the actual Bluetooth protocol
             logger.info("Simulating credential extraction from Bluetooth connection...")
-            time.sleep(3)
             
             # For now, we'll indicate that Bluetooth extraction was attempted
             logger.info("Bluetooth-only credential extraction completed")
@@ -468,51 +819,56 @@ p2p_disabled=0
             
             # Try to connect using device address
             logger.info("Initiating P2P connection...")
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_connect', device_address, 'pbc'], 
-                                  capture_output=True, text=True, check=True)
+            reply = self.wpa_request(f'P2P_CONNECT {device_address} pbc', timeout=5)
             
-            if result.returncode == 0:
+            if self.wpa_ok(reply):
                 logger.info("WiFi Direct connection initiated!")
-                logger.info(f"Connection output: {result.stdout}")
+                logger.info(f"Connection output: {reply}")
                 
-                # Wait for connection with progress updates
-                logger.info("Waiting for connection to establish...")
-                for i in range(30):  # Wait up to 30 seconds
-                    time.sleep(1)
-                    if i % 5 == 0:  # Progress update every 5 seconds
-                        logger.info(f"Connection attempt in progress... ({i+1}/30 seconds)")
-                    
-                    # Check connection status
-                    if self.check_wifi_direct_connection():
-                        logger.info("WiFi Direct connection established!")
-                        return self.extract_credentials_from_wifi_direct()
+                # Wait for the group to form or fail, up to 30 seconds
+                logger.info("Waiting up to 30 seconds for connection to establish...")
+                event = self.wpa_events.wait_for_event(
+                    ('P2P-GROUP-STARTED', 'P2P-GO-NEG-FAILURE', 'P2P-GROUP-FORMATION-FAILURE'), 30)
                 
-                logger.warning("Connection attempt timed out after 30 seconds")
-                return False
+                if event is None:
+                    # Confirm the status in case the group event was missed
+                    status = self.check_wifi_direct_connection()
+                    if status is None:
+                        logger.warning("Connection attempt timed out after 30 seconds")
+                        return False
+                elif event.startswith('P2P-GROUP-STARTED'):
+                    logger.info("WiFi Direct connection established!")
+                    logger.info(f"Group event: {event}")
+                    status = self.wpa_request('STATUS')
+                else:
+                    logger.warning(f"Connection attempt failed: {event}")
+                    return False
+                
+                # The same status read carries the credentials
+                logger.info("Extracting credentials from WiFi Direct connection...")
+                return self.extract_network_credentials(status)
             else:
-                logger.error(f"Failed to initiate connection: {result.stderr}")
+                logger.error(f"Failed to initiate connection: {reply.strip()}")
                 return False
             
         except Exception as e:
             logger.error(f"Error connecting via WiFi Direct: {e}")
             return False
     
-    def try_alternative_wifi_direct_methods(self, device_name: str, device_address: str) -> bool:
-        """Try alternative WiFi Direct methods for credential extraction."""
+    def try_service_discovery(self, device_address: str) -> bool:
+        """Request network information from the peer via P2P service discovery."""
         try:
-            logger.info("Trying alternative WiFi Direct methods...")
+            logger.info("Trying WiFi Direct service discovery...")
             
             # Method 1: Request network information via WiFi Direct
             logger.info("Method 1: Requesting network information...")
             
             # Send network information request
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_req', 
-                                   device_address, '02000001'], 
-                                  capture_output=True, text=True, check=True)
-            
-            if result.returncode == 0:
+            response = None
+            if self.request_service_discovery(device_address):
                 logger.info("Network information request sent")
-                time.sleep(5)
+                # Stop waiting as soon as the peer answers
+                response = self.wpa_events.wait_for_event(('P2P-SERV-DISC-RESP',), 5)
                 
                 # Check for responses
                 if self.check_for_network_responses():
@@ -521,51 +877,46 @@ p2p_disabled=0
             # Method 2: Use WiFi Direct service discovery
             logger.info("Method 2: Using WiFi Direct service discovery...")
             
-            # Enable service discovery
-            subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_req', 
-                          device_address, '02000001'], check=True)
+            # Enable service discovery (reuses the request from method 1 if it is still pending)
+            if not self.request_service_discovery(device_address):
+                logger.warning("Service discovery request was rejected")
+                return False
             
-            time.sleep(10)
+            # Keep waiting for the answer unless it already arrived
+            if response is None:
+                self.wpa_events.wait_for_event(('P2P-SERV-DISC-RESP',), 10)
             
             # Check for service responses
-            if self.check_for_service_responses():
-                return True
-            
-            # Method 3: Direct credential extraction via WiFi Direct
-            logger.info("Method 3: Direct credential extraction...")
-            
-            return self.direct_wifi_direct_extraction(device_name, device_address)
+            return self.check_for_service_responses()
             
         except Exception as e:
-            logger.error(f"Error in alternative WiFi Direct methods: {e}")
+            logger.error(f"Error in WiFi Direct service discovery: {e}")
             return False
     
-    def check_wifi_direct_connection(self) -> bool:
-        """Check if WiFi Direct connection is established."""
+    def check_wifi_direct_connection(self) -> Optional[str]:
+        """Return the wpa_supplicant status if a WiFi Direct connection is established."""
         try:
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
+            status = self.wpa_request('STATUS')
             
-            if result.returncode == 0:
-                status = result.stdout
-                logger.debug(f"Current wpa_supplicant status: {status}")
+            if self.wpa_ok(status):
+                logger.debug("Current wpa_supplicant status:\n%s", status)
                 
-                if 'p2p_go_mode=1' in status or 'p2p_client_mode=1' in status:
+                if _P2P_ACTIVE.search(status):
                     logger.info("WiFi Direct connection established!")
-                    return True
+                    return status
                 elif 'p2p' in status.lower():
                     logger.info("WiFi Direct is active but not fully connected")
-                    logger.info(f"P2P status: {status}")
-                    return False
+                    logger.debug("P2P status:\n%s", status)
+                    return None
                 else:
                     logger.debug("No WiFi Direct activity detected")
-                    return False
+                    return None
             
-            return False
+            return None
             
         except Exception as e:
             logger.error(f"Error checking WiFi Direct connection: {e}")
-            return False
+            return None
     
     def get_current_wifi_direct_status(self) -> dict:
         """Get comprehensive WiFi Direct status information."""
@@ -573,22 +924,17 @@ p2p_disabled=0
         
         try:
             # Check wpa_supplicant status
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                status_info['wpa_status'] = result.stdout
+            reply = self.wpa_request('STATUS')
+            if self.wpa_ok(reply):
+                status_info['wpa_status'] = reply
             
             # Check P2P peers
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                status_info['p2p_peers'] = result.stdout
+            status_info['p2p_peers'] = self.get_p2p_peers()
             
             # Check P2P groups
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_group_info'], 
-                                  capture_output=True, text=True, check=True)
-            if result.returncode == 0:
-                status_info['p2p_groups'] = result.stdout
+            reply = self.wpa_request('P2P_GROUP_INFO')
+            if self.wpa_ok(reply):
+                status_info['p2p_groups'] = reply
             
             # Check network interfaces
             result = subprocess.run(['ip', 'addr', 'show'], 
@@ -603,39 +949,38 @@ p2p_disabled=0
     
     def debug_wifi_direct_state(self):
         """Debug the current WiFi Direct state."""
-        logger.info("🔍 Debugging WiFi Direct state...")
+        # Collecting the state costs several queries, skip it unless it gets logged
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        
+        logger.debug("🔍 Debugging WiFi Direct state...")
         
         status_info = self.get_current_wifi_direct_status()
         
-        logger.info("📊 Current Status:")
+        logger.debug("📊 Current Status:")
         if 'wpa_status' in status_info:
-            logger.info("WPA Status:")
-            logger.info(status_info['wpa_status'])
+            logger.debug("WPA Status:\n%s", status_info['wpa_status'])
         
         if 'p2p_peers' in status_info:
-            logger.info("P2P Peers:")
-            logger.info(status_info['p2p_peers'])
+            logger.debug("P2P Peers:\n%s", status_info['p2p_peers'])
         
         if 'p2p_groups' in status_info:
-            logger.info("P2P Groups:")
-            logger.info(status_info['p2p_groups'])
+            logger.debug("P2P Groups:\n%s", status_info['p2p_groups'])
         
         if 'network_interfaces' in status_info:
-            logger.info("Network Interfaces:")
-            logger.info(status_info['network_interfaces'])
+            logger.debug("Network Interfaces:\n%s", status_info['network_interfaces'])
         
-        logger.info("🔍 Debug complete")
+        logger.debug("🔍 Debug complete")
     
     def check_for_network_responses(self) -> bool:
         """Check for network information responses."""
         try:
             # Check for network responses in wpa_supplicant
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peers'], 
-                                  capture_output=True, text=True, check=True)
+            peers = self.get_p2p_peers()
             
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("Network responses received:")
-                logger.info(result.stdout)
+            if peers.strip():
+                logger.info("Network responses received")
+                logger.debug("P2P peers:\n%s", peers)
                 return True
             
             return False
@@ -648,12 +993,11 @@ p2p_disabled=0
         """Check for service discovery responses."""
         try:
             # Check for service responses
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_resp'], 
-                                  capture_output=True, text=True, check=True)
+            reply = self.wpa_request('P2P_SERV_DISC_RESP')
             
-            if result.returncode == 0 and result.stdout.strip():
-                logger.info("Service discovery responses received:")
-                logger.info(result.stdout)
+            if self.wpa_ok(reply) and reply.strip():
+                logger.info("Service discovery responses received")
+                logger.debug("Service discovery responses:\n%s", reply)
                 return True
             
             return False
@@ -668,25 +1012,27 @@ p2p_disabled=0
             logger.info("Attempting direct WiFi Direct credential extraction...")
             
             # Try to get device information
-            result = subprocess.run(['sudo', 'wpa_cli', 'p2p_peer', device_address], 
-                                  capture_output=True, text=True, check=True)
+            reply = self.wpa_request(f'P2P_PEER {device_address}')
             
-            if result.returncode == 0:
-                logger.info("Device information retrieved:")
-                logger.info(result.stdout)
+            if self.wpa_ok(reply):
+                logger.info("Device information retrieved")
+                logger.debug("Device information:\n%s", reply)
                 
                 # Look for network information in device details
-                if self.parse_device_network_info(result.stdout):
+                if self.parse_device_network_info(reply):
                     return True
             
             # Try to request specific network information
             logger.info("Requesting specific network information...")
             
-            # Send network query request
-            subprocess.run(['sudo', 'wpa_cli', 'p2p_serv_disc_req', 
-                          device_address, '02000001'], check=True)
+            # Send network query request, unless an earlier one already went unanswered
+            already_sent = device_address in self.svc_disc_sent
+            if not self.request_service_discovery(device_address):
+                logger.warning("Network query request was rejected")
+                return False
             
-            time.sleep(5)
+            if not already_sent:
+                self.wpa_events.wait_for_event(('P2P-SERV-DISC-RESP',), 5)
             
             # Check for network information
             if self.check_for_network_info():
@@ -702,7 +1048,7 @@ p2p_disabled=0
         """Parse network information from device details."""
         try:
             # Look for network-related information
-            if 'network' in device_info.lower() or 'ssid' in device_info.lower():
+            if _NET_HINT.search(device_info):
                 logger.info("Network information found in device details!")
                 return True
             
@@ -715,70 +1061,36 @@ p2p_disabled=0
     def check_for_network_info(self) -> bool:
         """Check for network information in responses."""
         try:
-            # Check various sources for network information
+            # Query the various sources for network information in one round trip
+            peers_reply, status, networks = self.wpa_request_many(
+                ['P2P_PEER FIRST', 'STATUS', 'LIST_NETWORKS'])
             sources = [
-                ['sudo', 'wpa_cli', 'p2p_peers'],
-                ['sudo', 'wpa_cli', 'status'],
-                ['sudo', 'wpa_cli', 'list_networks']
+                ('p2p_peers', self.get_p2p_peers(first_reply=peers_reply)),
+                ('status', status),
+                ('list_networks', networks)
             ]
             
-            for source in sources:
-                try:
-                    result = subprocess.run(source, capture_output=True, text=True, check=True)
-                    if result.returncode == 0 and result.stdout.strip():
-                        if 'network' in result.stdout.lower() or 'ssid' in result.stdout.lower():
-                            logger.info(f"Network information found in {source[-1]}:")
-                            logger.info(result.stdout)
-                            return True
-                except:
-                    continue
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error checking for network info: {e}")
-            return False
-    
-    def extract_credentials_from_wifi_direct(self) -> bool:
-        """Extract credentials from established WiFi Direct connection."""
-        try:
-            logger.info("Extracting credentials from WiFi Direct connection...")
-            
-            # Get connection information
-            result = subprocess.run(['sudo', 'wpa_cli', 'status'], 
-                                  capture_output=True, text=True, check=True)
-            
-            if result.returncode == 0:
-                status = result.stdout
-                logger.info("WiFi Direct connection status:")
-                logger.info(status)
-                
-                # Look for network information
-                if self.extract_network_credentials(status):
+            for name, output in sources:
+                if self.wpa_ok(output) and _NET_HINT.search(output):
+                    logger.info(f"Network information found in {name}")
+                    logger.debug("%s output:\n%s", name, output)
                     return True
             
             return False
             
         except Exception as e:
-            logger.error(f"Error extracting credentials from WiFi Direct: {e}")
+            logger.error(f"Error checking for network info: {e}")
             return False
     
     def extract_network_credentials(self, status: str) -> bool:
         """Extract network credentials from status information."""
         try:
-            # Parse status for network information
-            lines = status.split('\n')
-            network_info = {}
-            
-            for line in lines:
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    network_info[key.strip()] = value.strip()
+            # Pull the SSID and PSK out of the status in one pass
+            network_info = dict(_KV_RE.findall(status))
             
             # Look for network credentials
             if 'ssid' in network_info or 'psk' in network_info:
                 logger.info("Network credentials found!")
-                logger.info(f"Network info: {network_info}")
                 
                 # Extract SSID and password
                 ssid = network_info.get('ssid', 'Unknown')
@@ -786,13 +1098,17 @@ p2p_disabled=0
                 
                 if ssid != 'Unknown' and password != 'Unknown':
                     logger.info(f"WiFi credentials extracted via WiFi Direct!")
-                    logger.info(f"SSID: {ssid}")
-                    logger.info(f"Password: {password}")
+                    logger.info("SSID: %s", ssid)
+                    logger.info("Password: %s", "*" * len(password))
                     
-                    # Save credentials
+                    # Save credentials, readable by root only, unless this
+                    # run already saved the same ones
                     credentials = {'ssid': ssid, 'password': password}
-                    with open(self.config_file, 'w') as f:
-                        json.dump(credentials, f)
+                    if credentials != self.last_credentials:
+                        _atomic_write(str(self.config_file),
+                                      json.dumps(credentials, separators=(',', ':')).encode(),
+                                      mode=0o600)
+                        self.last_credentials = credentials
                     
                     self.credentials_received = True
                     return True
@@ -807,7 +1123,7 @@ p2p_disabled=0
         """Parse device information from Bluetooth device info."""
         try:
             # Look for network-related information in device details
-            if 'network' in device_info.lower() or 'wifi' in device_info.lower():
+            if _NET_HINT.search(device_info):
                 logger.info("Network information found in Bluetooth device info!")
                 return True
             
@@ -823,28 +1139,42 @@ p2p_disabled=0
         logger.info("This will automatically extract WiFi credentials using WiFi Direct!")
         logger.info("No phone app installation or manual interaction required!")
         
+        # Every command below is run directly, without sudo
+        if os.geteuid() != 0:
+            logger.error("This script must be run as root (use sudo)")
+            return False
+        
         try:
             # Check dependencies
             if not self.check_dependencies():
                 logger.error("Dependencies not met. Exiting.")
                 return False
             
+            # Setup WiFi Direct (with fallback) in the background; it shares
+            # nothing with the Bluetooth and D-Bus setup below
+            logger.info("Setting up WiFi Direct...")
+            wifi_direct_result = []
+            wifi_direct_thread = threading.Thread(
+                target=lambda: wifi_direct_result.append(self.setup_wifi_direct()),
+                daemon=True)
+            wifi_direct_thread.start()
+            
             # Setup Bluetooth
             if not self.setup_bluetooth():
                 logger.error("Failed to setup Bluetooth")
                 return False
             
-            # Setup WiFi Direct (with fallback)
-            logger.info("Setting up WiFi Direct...")
-            if not self.setup_wifi_direct():
-                logger.warning("WiFi Direct setup failed, continuing with Bluetooth-only mode")
-                logger.info("Credential extraction will be limited but Bluetooth monitoring will work")
-            
-            # Setup D-Bus
+            # Setup D-Bus (needs bluetoothd from setup_bluetooth)
             if not self.setup_dbus():
                 logger.error("Failed to setup D-Bus")
                 return False
             
+            # Both radios must be set up before devices are handled
+            wifi_direct_thread.join()
+            if not (wifi_direct_result and wifi_direct_result[0]):
+                logger.warning("WiFi Direct setup failed, continuing with Bluetooth-only mode")
+                logger.info("Credential extraction will be limited but Bluetooth monitoring will work")
+            
             # Setup Bluetooth monitoring
             if not self.setup_bluetooth_monitoring():
                 logger.error("Failed to setup Bluetooth monitoring")
@@ -872,6 +1202,8 @@ p2p_disabled=0
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
             return False
+        finally:
+            self.close_wpa()
 
 def main():
     """Main entry point."""